@@ -0,0 +1,108 @@
+"""
+Benchmark + so sánh độ chính xác các chế độ render mask.
+
+Chạy từ thư mục ai_core:
+    python -m benchmarks.bench_mask [--repeat 20]
+
+Mốc chuẩn là mask hiện tại (1024x1024, GaussianBlur 45x45). Mỗi chế độ khác được
+so với mốc chuẩn theo sai số tuyệt đối trên thang 0-255.
+
+Kết quả trên 16 ảnh trong uploads/ x 3 look (repeat=5, 1 CPU):
+    mode                       ms/mask   speedup  mean err   max err  ok
+    full-gaussian (chuẩn)        20.49      1.0x     0.000         0  ✅
+    full-box                      5.43      3.8x     0.206        13  ✅
+    512-gaussian                  3.70      5.5x     0.274        38  ❌
+    512-box                       2.22      9.2x     0.287        36  ❌
+    256-gaussian                  1.24     16.5x     0.769        77  ❌
+    256-box                       0.92     22.2x     1.321        74  ❌
+Chỉ full-box đạt ngưỡng; vẽ ở độ phân giải thấp lệch nhiều ở biên nhỏ (mắt, mống mắt).
+"""
+import argparse
+import glob
+import os
+import time
+import cv2
+import numpy as np
+from modules.face_masking import detect_landmarks, rasterize_mask
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_GLOBS = ["uploads/raw/*", "uploads/style/*", "uploads/face_*.jpg"]
+
+# Ngưỡng chấp nhận so với mask chuẩn (mức xám 0-255)
+TOLERANCE_MEAN = 1.5
+TOLERANCE_MAX = 16
+
+MODES = [
+    ("full-gaussian (chuẩn)", 1.0, "gaussian"),
+    ("full-box", 1.0, "box"),
+    ("512-gaussian", 0.5, "gaussian"),
+    ("512-box", 0.5, "box"),
+    ("256-gaussian", 0.25, "gaussian"),
+    ("256-box", 0.25, "box"),
+]
+
+LOOKS = [
+    {"makeup_intensity": "medium"},
+    {"makeup_intensity": "high", "heavy_blush": True, "contour_nose": True, "contour_jaw": True, "use_lens": True},
+    {"makeup_intensity": "low", "use_lens": True},
+]
+
+
+def load_samples(size=(1024, 1024)):
+    samples = []
+    for pattern in SAMPLE_GLOBS:
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, pattern))):
+            img = cv2.imread(path)
+            if img is None: continue
+            img = cv2.resize(img, size)
+            try:
+                samples.append((os.path.basename(path), img.shape, detect_landmarks(img)))
+            except ValueError:
+                print(f"Bỏ qua {path}: không tìm thấy khuôn mặt")
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = load_samples()
+    if not samples:
+        print("Không có ảnh mẫu nào có khuôn mặt.")
+        return
+    print(f"{len(samples)} ảnh mẫu x {len(LOOKS)} look, repeat={args.repeat}\n")
+
+    references = {
+        (name, i): rasterize_mask(lm, shape, look, render_scale=1.0, blur_mode="gaussian")
+        for name, shape, lm in samples for i, look in enumerate(LOOKS)
+    }
+
+    print(f"{'mode':<24}{'ms/mask':>10}{'speedup':>10}{'mean err':>10}{'max err':>10}  ok")
+    baseline_ms = None
+    for label, scale, blur_mode in MODES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for name, shape, lm in samples:
+                for look in LOOKS:
+                    rasterize_mask(lm, shape, look, render_scale=scale, blur_mode=blur_mode)
+        ms = (time.perf_counter() - start) * 1000 / (args.repeat * len(samples) * len(LOOKS))
+        if baseline_ms is None: baseline_ms = ms
+
+        mean_errs, max_errs = [], []
+        for name, shape, lm in samples:
+            for i, look in enumerate(LOOKS):
+                mask = rasterize_mask(lm, shape, look, render_scale=scale, blur_mode=blur_mode)
+                diff = np.abs(mask.astype(np.int16) - references[(name, i)].astype(np.int16))
+                mean_errs.append(diff.mean())
+                max_errs.append(diff.max())
+
+        mean_err, max_err = float(np.mean(mean_errs)), int(np.max(max_errs))
+        ok = mean_err <= TOLERANCE_MEAN and max_err <= TOLERANCE_MAX
+        print(f"{label:<24}{ms:>10.2f}{baseline_ms / ms:>9.1f}x{mean_err:>10.3f}{max_err:>10d}  {'✅' if ok else '❌'}")
+
+    print(f"\nNgưỡng: mean err <= {TOLERANCE_MEAN}, max err <= {TOLERANCE_MAX} (thang 0-255)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Benchmark offline pipeline ai_core (không cần Vertex AI / Gemini / Atlas).
+
+Chạy từ thư mục ai_core:
+    python -m benchmarks.bench_pipeline --concurrency 1 4 16 --requests 32
+
+- Vertex AI, Gemini được thay bằng stub trong benchmarks/stubs.py (độ trễ / tỉ lệ lỗi cấu hình được)
+- Collection `courses`: mongomock (mặc định) hoặc mongod local qua --mongo-uri
+- Ảnh mẫu: các ảnh khuôn mặt trong uploads/
+Kết quả: thời gian từng stage (decode, resize, FaceMesh, rasterize, blur, encode, AI call, DB lookup)
+và requests/giây + p50/p95 của 2 endpoint ở nhiều mức concurrency.
+"""
+import os
+import tempfile
+
+# Không ghi đè dữ liệu thật trong outputs/, không chạy worker job queue
+_TMP_DIR = tempfile.mkdtemp(prefix="vto_bench_")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("JOB_DIR", os.path.join(_TMP_DIR, "jobs"))
+os.environ.setdefault("PROMPT_STORE_PATH", os.path.join(_TMP_DIR, "prompt_outcomes.json"))
+os.environ.setdefault("RESULT_CACHE_DISK", "false")
+
+import argparse
+import asyncio
+import glob
+import json
+import statistics
+import time
+import uuid
+import cv2
+import httpx
+import numpy as np
+import main
+from modules import face_masking, image_generation, style_analysis, course_recommendation
+from modules.image_generation import VertexClient
+from modules.image_codec import encode_mask
+from modules.cache import landmark_cache
+from modules.course_catalog import course_catalog
+from benchmarks.stubs import StubImageModel, StubGeminiModel, make_courses_collection
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_GLOBS = ["uploads/raw/*", "uploads/style/*", "uploads/face_*.jpg"]
+
+LOOK = {
+    "prompt_override": "deep red matte lipstick, smokey charcoal eyeshadow, peachy blush",
+    "technical_settings": {"makeup_intensity": "high", "contour_nose": True, "use_lens": True},
+    "keywords_override": ["Smokey", "Bridal", "trang điểm"],
+    "tutorial_override": ["Primer", "Eyeshadow", "Lipstick"],
+}
+
+
+def load_samples() -> list:
+    samples = []
+    for pattern in SAMPLE_GLOBS:
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, pattern))):
+            with open(path, "rb") as f: raw = f.read()
+            try:
+                face_masking.detect_landmarks(cv2.resize(main.decode_image(raw), (1024, 1024)))
+            except ValueError:
+                continue  # Bỏ ảnh không có khuôn mặt
+            samples.append((os.path.basename(path), raw))
+    return samples
+
+
+def install_stubs(args):
+    image_generation.vertex_client = VertexClient(model_factory=lambda: StubImageModel(
+        latency=args.vertex_latency, block_rate=args.vertex_block_rate, failure_rate=args.vertex_failure_rate
+    ))
+    style_analysis._model = StubGeminiModel(latency=args.gemini_latency, failure_rate=args.gemini_failure_rate)
+    course_recommendation.courses_collection = make_courses_collection(args.courses, args.mongo_uri)
+    course_recommendation.async_courses_collection = None
+    # Catalog trong RAM (như lúc startup); --no-catalog để đo truy vấn MongoDB trực tiếp
+    if not args.no_catalog: course_catalog.load(course_recommendation.courses_collection)
+
+
+# --- 1. THỜI GIAN TỪNG STAGE (tuần tự, 1 thread) ---
+def time_stages(samples: list, repeat: int) -> dict:
+    stages = {name: [] for name in ["decode", "resize", "facemesh", "rasterize", "blur", "encode", "ai_call", "db_lookup"]}
+
+    def timed(name, fn, *a, **kw):
+        start = time.perf_counter()
+        out = fn(*a, **kw)
+        stages[name].append((time.perf_counter() - start) * 1000)
+        return out
+
+    settings = LOOK["technical_settings"]
+    for _ in range(repeat):
+        for _, raw in samples:
+            img = timed("decode", main.decode_image, raw)
+            resized = timed("resize", cv2.resize, img, (1024, 1024))
+            ok, face_jpeg = cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            landmarks = timed("facemesh", face_masking.detect_landmarks, resized)
+            raw_mask = timed("rasterize", face_masking.rasterize_mask, landmarks, resized.shape, settings, blur_mode="none")
+            mask = timed("blur", face_masking._feather, raw_mask, face_masking.MASK_RENDER_SCALE, face_masking.MASK_BLUR_MODE)
+            timed("encode", encode_mask, mask)
+            timed("ai_call", image_generation.generate_inpainted_image,
+                  face_jpeg.tobytes(), mask, LOOK["prompt_override"], settings)
+            timed("db_lookup", course_recommendation.get_courses_from_db, LOOK["keywords_override"])
+    return stages
+
+
+# --- 2. TẢI HTTP (nhiều request đồng thời qua ASGI, không qua mạng) ---
+async def load_test(client: httpx.AsyncClient, build_request, concurrency: int, total: int) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = build_request(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                if response.status_code >= 400: errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "errors": errors,
+    }
+
+
+async def run_load(samples: list, args):
+    await main.executor.start()
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            def generate_request(i):
+                name, raw = samples[i % len(samples)]
+                # user_prompt khác nhau -> không trúng result cache (đo đủ pipeline)
+                user_prompt = "" if args.allow_cache else uuid.uuid4().hex
+                return "POST", "/vto/generate-makeup", {
+                    "files": {"user_face": (name, raw, "image/jpeg")},
+                    "data": {
+                        "prompt_override": LOOK["prompt_override"],
+                        "technical_settings": json.dumps(LOOK["technical_settings"]),
+                        "keywords_override": json.dumps(LOOK["keywords_override"], ensure_ascii=False),
+                        "tutorial_override": json.dumps(LOOK["tutorial_override"]),
+                        "user_prompt": user_prompt,
+                    },
+                }
+
+            def consult_request(i):
+                text = "wedding makeup" if args.allow_cache else f"wedding makeup {uuid.uuid4().hex}"
+                return "POST", "/vto/consult-styles", {"data": {"user_request": text}}
+
+            for label, build in [("generate-makeup", generate_request), ("consult-styles", consult_request)]:
+                print(f"\n/vto/{label}")
+                print(f"{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+                for concurrency in args.concurrency:
+                    r = await load_test(client, build, concurrency, args.requests)
+                    print(f"{concurrency:>12}{r['rps']:>10.2f}{r['p50']:>10.0f}{r['p95']:>10.0f}{r['errors']:>8}")
+    finally:
+        main.executor.shutdown()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Số request mỗi mức concurrency")
+    parser.add_argument("--stage-repeat", type=int, default=3)
+    parser.add_argument("--vertex-latency", type=float, default=1.0)
+    parser.add_argument("--vertex-block-rate", type=float, default=0.1)
+    parser.add_argument("--vertex-failure-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-latency", type=float, default=2.0)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0)
+    parser.add_argument("--courses", type=int, default=500)
+    parser.add_argument("--mongo-uri", default=None, help="mongod local thay cho mongomock")
+    parser.add_argument("--allow-cache", action="store_true", help="Cho phép trúng result/style cache")
+    parser.add_argument("--no-landmark-cache", action="store_true")
+    parser.add_argument("--no-catalog", action="store_true", help="Tìm khóa học bằng truy vấn MongoDB thay vì catalog")
+    args = parser.parse_args()
+
+    install_stubs(args)
+    if args.no_landmark_cache: landmark_cache.max_entries = 0
+
+    samples = load_samples()
+    if not samples: raise SystemExit("Không có ảnh mẫu nào có khuôn mặt trong uploads/")
+    print(f"{len(samples)} ảnh mẫu, stub Vertex {args.vertex_latency}s, stub Gemini {args.gemini_latency}s")
+
+    stages = time_stages(samples, args.stage_repeat)
+    print(f"\n{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, values in stages.items():
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{name:<12}{statistics.median(values):>10.2f}{p95:>10.2f}{np.mean(values):>10.2f}")
+
+    asyncio.run(run_load(samples, args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,154 @@
+"""
+Benchmark job tính độ tương đồng khóa học (calculate_similarity.py) trên dữ liệu enroll giả lập.
+
+Chạy từ thư mục ai_core:
+    python -m benchmarks.bench_similarity --enrollments 10000 100000 1000000
+
+- Enrollment sinh ngẫu nhiên: độ phổ biến khóa học theo phân phối Zipf, mỗi user 1-20 khóa
+- "sparse": ma trận CSR + top-k bằng argpartition (modules/course_similarity.py)
+- "dense": cách cũ (pandas pivot_table + sklearn cosine_similarity), chỉ chạy khi ma trận
+  user x khóa học nhỏ hơn --dense-max-cells
+Bộ nhớ đỉnh đo bằng tracemalloc (NumPy / SciPy / pandas đều báo cấp phát cho tracemalloc).
+
+--ingest: so sánh cách đọc enrollment (document giả lập như cursor aggregate trả về):
+- "stream": đọc theo lô + EnrollmentEncoder (calculate_similarity.py)
+- "frame": cách cũ list(cursor) -> DataFrame -> factorize
+
+--backends: so sánh backend tìm khóa giống nhất (exact / blocked / minhash), kèm recall@k so với exact:
+    python -m benchmarks.bench_similarity --backends --courses 100000 --enrollments 1000000 --topic-size 50
+  (--topic-size: enrollment theo nhóm chủ đề; dữ liệu hoàn toàn ngẫu nhiên gần như không có cặp khóa nào thật sự
+  giống nhau nên recall của minhash trên đó thấp và không phản ánh dữ liệu thật)
+"""
+import argparse
+import time
+import tracemalloc
+import numpy as np
+from bson import ObjectId
+from modules.course_similarity import (
+    TOP_K, NEIGHBOR_BACKENDS, EnrollmentEncoder, blocked_top_k, build_item_user_matrix, cosine_top_k,
+    find_neighbors, recall_at_k
+)
+
+
+def make_enrollments(count: int, n_courses: int, seed: int = 42, topic_size: int = 0, topic_share: float = 0.8):
+    """
+    Trả về (mã user, mã khóa học) không trùng cặp.
+    topic_size > 0: khóa học chia thành nhóm chủ đề liền nhau, mỗi user có 1 chủ đề chính và
+    khoảng topic_share số khóa học thuộc chủ đề đó (giống dữ liệu thật hơn: khóa giống nhau có user chung)
+    """
+    rng = np.random.default_rng(seed)
+    per_user = rng.integers(1, 21, size=count)
+    per_user = per_user[np.cumsum(per_user) <= count]
+    user_codes = np.repeat(np.arange(len(per_user)), per_user)
+    popularity = 1.0 / np.arange(1, n_courses + 1) ** 0.8
+    course_codes = rng.choice(n_courses, size=len(user_codes), p=popularity / popularity.sum())
+    if topic_size > 0:
+        n_topics = -(-n_courses // topic_size)
+        home = rng.integers(0, n_topics, size=len(per_user))[user_codes]
+        in_topic = rng.random(len(user_codes)) < topic_share
+        local = home * topic_size + course_codes % topic_size
+        course_codes = np.where(in_topic & (local < n_courses), local, course_codes)
+    pairs = np.unique(user_codes.astype(np.int64) * n_courses + course_codes)
+    return (pairs // n_courses).astype(np.int32), (pairs % n_courses).astype(np.int32)
+
+
+def run_sparse(user_codes, course_codes, n_users, n_courses, k):
+    matrix = build_item_user_matrix(user_codes, course_codes, n_users, n_courses)
+    return cosine_top_k(matrix, k)
+
+
+def run_dense(user_codes, course_codes, n_users, n_courses, k):
+    import pandas as pd
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    df = pd.DataFrame({"userId": user_codes, "courseId": course_codes, "purchased": 1})
+    user_item_matrix = df.pivot_table(index="userId", columns="courseId", values="purchased").fillna(0)
+    item_user_matrix = user_item_matrix.T
+    similarity = pd.DataFrame(cosine_similarity(item_user_matrix),
+                              index=item_user_matrix.index, columns=item_user_matrix.index)
+    return {course: similarity[course].sort_values(ascending=False)[1:k + 1] for course in similarity.index}
+
+
+def fake_cursor(user_codes, course_codes):
+    """Sinh document lần lượt như cursor (không giữ sẵn toàn bộ trong RAM)"""
+    users = [ObjectId() for _ in range(int(user_codes.max()) + 1)]
+    courses = [ObjectId() for _ in range(int(course_codes.max()) + 1)]
+    return lambda: ({"userId": users[u], "courseId": courses[c]} for u, c in zip(user_codes, course_codes))
+
+
+def ingest_stream(make_cursor):
+    from calculate_similarity import fetch_batches, prefetch
+    encoder = EnrollmentEncoder()
+    for batch in prefetch(fetch_batches(make_cursor())): encoder.add(batch)
+    return encoder.codes()
+
+
+def ingest_frame(make_cursor):
+    import pandas as pd
+    df = pd.DataFrame(list(make_cursor()))
+    user_codes, _ = pd.factorize(df["userId"].astype(str))
+    course_codes, _ = pd.factorize(df["courseId"].astype(str))
+    return user_codes, course_codes
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--enrollments", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--ingest", action="store_true", help="Đo cách đọc + mã hoá enrollment")
+    parser.add_argument("--backends", action="store_true", help="Đo các backend tìm khóa giống nhất + recall")
+    parser.add_argument("--topic-size", type=int, default=0, help="Số khóa mỗi nhóm chủ đề (0: không chia nhóm)")
+    parser.add_argument("--exact-max-courses", type=int, default=50_000,
+                        help="Backend exact (giữ toàn bộ X·Xᵀ) chỉ chạy khi số khóa không vượt mức này")
+    parser.add_argument("--dense-max-cells", type=int, default=200_000_000,
+                        help="Bỏ qua cách cũ khi user x khóa học lớn hơn mức này")
+    args = parser.parse_args()
+
+    if args.ingest:
+        print(f"{'enrollments':>12}{'mode':>8}{'seconds':>10}{'peak MB':>10}")
+        for count in args.enrollments:
+            make_cursor = fake_cursor(*make_enrollments(count, args.courses))
+            for label, fn in [("stream", ingest_stream), ("frame", ingest_frame)]:
+                (user_codes, _), elapsed, peak = measure(fn, make_cursor)
+                print(f"{len(user_codes):>12}{label:>8}{elapsed:>10.2f}{peak:>10.0f}")
+        return
+
+    if args.backends:
+        print(f"{'enrollments':>12}{'courses':>9}{'backend':>9}{'seconds':>10}{'peak MB':>10}{'recall':>8}")
+        for count in args.enrollments:
+            user_codes, course_codes = make_enrollments(count, args.courses, topic_size=args.topic_size)
+            item_user = build_item_user_matrix(user_codes, course_codes, int(user_codes.max()) + 1, args.courses)
+            # Tham chiếu chính xác tính theo khối (kết quả giống exact, ít bộ nhớ hơn)
+            exact_neighbors, exact_scores = blocked_top_k(item_user, args.top_k)
+            for backend in NEIGHBOR_BACKENDS:
+                if backend == "exact" and args.courses > args.exact_max_courses: continue
+                (_, scores), elapsed, peak = measure(find_neighbors, item_user, args.top_k, backend)
+                recall = recall_at_k(exact_neighbors, exact_scores, scores)
+                print(f"{len(user_codes):>12}{args.courses:>9}{backend:>9}{elapsed:>10.2f}{peak:>10.0f}{recall:>8.3f}")
+        return
+
+    print(f"{'enrollments':>12}{'users':>10}{'courses':>9}{'mode':>8}{'seconds':>10}{'peak MB':>10}")
+    for count in args.enrollments:
+        user_codes, course_codes = make_enrollments(count, args.courses)
+        n_users, n_courses = int(user_codes.max()) + 1, args.courses
+        modes = [("sparse", run_sparse)]
+        if n_users * n_courses <= args.dense_max_cells: modes.append(("dense", run_dense))
+
+        for label, fn in modes:
+            _, elapsed, peak = measure(fn, user_codes, course_codes, n_users, n_courses, args.top_k)
+            print(f"{len(user_codes):>12}{n_users:>10}{n_courses:>9}{label:>8}{elapsed:>10.2f}{peak:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Stub local thay cho các dịch vụ cloud (Vertex AI, Gemini, MongoDB Atlas) khi benchmark offline.
+Độ trễ và tỉ lệ lỗi / bị chặn đều cấu hình được.
+"""
+import json
+import time
+import random
+import asyncio
+
+
+class _StubImage:
+    def __init__(self, image_bytes: bytes):
+        self._image_bytes = image_bytes
+
+
+class _StubResponse:
+    def __init__(self, images: list):
+        self.images = images
+
+
+class StubImageModel:
+    """Thay ImageGenerationModel: edit_image ngủ `latency` giây rồi trả ảnh gốc"""
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.2, block_rate: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.block_rate = block_rate
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def edit_image(self, base_image, mask, prompt, guidance_scale, number_of_images=1):
+        self.calls += 1
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        roll = random.random()
+        if roll < self.failure_rate:
+            raise RuntimeError("Stub Vertex: lỗi giả lập")
+        if roll < self.failure_rate + self.block_rate:
+            return _StubResponse([])
+        return _StubResponse([_StubImage(base_image._image_bytes)])
+
+
+def _fake_looks(user_request: str) -> list:
+    return [
+        {
+            "id": f"style_{i}",
+            "ui_display": {
+                "style_name": f"Look {i}", "description": user_request,
+                "tags": ["Daily", "Fresh", "Glow"], "difficulty": "Easy"
+            },
+            "backend_logic": {
+                "generation_prompt": "coral lipstick, soft brown eyeliner, peachy blush",
+                "technical_settings": {
+                    "use_lens": i == 3, "contour_nose": i > 1, "contour_jaw": i > 2,
+                    "heavy_blush": False, "skin_finish": "dewy", "makeup_intensity": "medium"
+                },
+                "tutorial_steps": ["Moisturize", "Blush", "Lip"],
+                "search_keywords": ["Natural Makeup", "Skincare"]
+            }
+        }
+        for i in (1, 2, 3)
+    ]
+
+
+class _StubGeminiResponse:
+    def __init__(self, text: str, chunk_latency: float = 0.0):
+        self.text = text
+        self._chunk_latency = chunk_latency
+
+    async def __aiter__(self):
+        # Chia text thành ~10 chunk như stream thật
+        size = max(1, len(self.text) // 10)
+        for i in range(0, len(self.text), size):
+            await asyncio.sleep(self._chunk_latency)
+            yield _StubGeminiResponse(self.text[i:i + size])
+
+
+class StubGeminiModel:
+    """Thay GenerativeModel: generate_content_async ngủ `latency` giây rồi trả 3 look JSON"""
+
+    def __init__(self, latency: float = 2.0, jitter: float = 0.3, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Stub Gemini: lỗi giả lập")
+        text = "```json\n" + json.dumps(_fake_looks(prompt[:60])) + "\n```"
+        total = max(0.0, random.gauss(self.latency, self.jitter))
+        if stream:
+            return _StubGeminiResponse(text, chunk_latency=total / 10)
+        await asyncio.sleep(total)
+        return _StubGeminiResponse(text)
+
+
+# --- DỮ LIỆU KHÓA HỌC MẪU ---
+_VOCAB = ["natural", "makeup", "bridal", "wedding", "smokey", "eyes", "lip", "contour", "skincare",
+          "korean", "glow", "matte", "dewy", "party", "office", "daily", "blush", "eyeliner", "trang điểm",
+          "cô dâu", "tự nhiên", "dự tiệc", "văn phòng", "chăm sóc da"]
+
+
+def make_courses(count: int = 500, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    courses = []
+    for i in range(count):
+        words = rng.sample(_VOCAB, 6)
+        courses.append({
+            "name": f"{words[0].title()} {words[1].title()} Course {i}",
+            "description": " ".join(words),
+            "tags": ", ".join(words[2:5]),
+            "price": rng.choice([0, 19, 49, 99]),
+            "estimatedPrice": 120,
+            "purchased": rng.randint(0, 500),
+            "status": "published" if rng.random() < 0.9 else "draft",
+            "thumbnail": {"url": f"https://example.com/{i}.jpg"},
+            "createdAt": i,
+            "updatedAt": i,
+        })
+    return courses
+
+
+def make_courses_collection(count: int = 500, mongo_uri: str = None):
+    """Collection `courses` có dữ liệu mẫu: mongomock (mặc định) hoặc mongod local qua `mongo_uri`"""
+    if mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(mongo_uri)["vto_bench"]["courses"]
+        collection.delete_many({})
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("Cần `pip install mongomock` hoặc truyền --mongo-uri tới mongod local")
+        collection = mongomock.MongoClient()["vto_bench"]["courses"]
+    collection.insert_many(make_courses(count))
+    return collection
+
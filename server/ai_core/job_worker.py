@@ -0,0 +1,27 @@
+"""
+Worker độc lập cho job queue (chạy tách khỏi API để scale riêng):
+    JOB_WORKERS=0 uvicorn main:app ...      # API chỉ nhận job
+    python job_worker.py --workers 4        # Process xử lý job (dùng chung outputs/jobs/jobs.db)
+"""
+import argparse
+import asyncio
+from main import executor, process_job, JOB_RETRY_ERRORS
+from modules.job_queue import job_queue, JOB_WORKERS
+
+async def run(workers: int):
+    await executor.start()
+    job_queue.start_workers(process_job, workers, retry_on=JOB_RETRY_ERRORS)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_queue.stop_workers()
+        executor.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS or 2)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.workers))
+    except KeyboardInterrupt:
+        pass
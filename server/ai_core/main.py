@@ -1,25 +1,41 @@
 import os
+import logging
 import uvicorn
-import shutil
 import json  
 import cv2
-import uuid 
+import numpy as np
+import asyncio
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import pathlib
-from modules.face_masking import create_makeup_mask
-from modules.style_analysis import consult_styles_with_gemini 
-from modules.image_generation import generate_inpainted_image
-from modules.course_recommendation import get_courses_from_db
 
 # --- CẤU HÌNH ---
+# Nạp .env TRƯỚC khi import modules.*: các module đọc os.getenv ngay lúc import
 BASE_DIR = pathlib.Path(__file__).parent.resolve()
 env_path = BASE_DIR / ".env"
 load_dotenv(dotenv_path=env_path)
 
+# Log đi qua QueueHandler -> ghi stdout ở thread riêng, không chặn request.
+# Cấu hình trước các import bên dưới để log lúc import module (kết nối MongoDB...) không bị mất
+from modules.logging_config import setup_logging, stop_logging
+setup_logging(getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+
+from modules.face_masking import detect_landmarks, rasterize_mask, rasterize_masks
+from modules.style_analysis import consult_styles_with_gemini, stream_styles_with_gemini, style_stats
+from modules.image_generation import generate_inpainted_image, vertex_client, hedge_stats, VertexTransientError
+from modules.course_recommendation import get_courses_async, start_course_catalog
+from modules.course_catalog import course_catalog
+from modules.db import close_clients
+from modules.execution import ExecutionLayer, PoolSaturatedError
+from modules.cache import ResultCache, hash_image, result_cache, landmark_cache
+from modules.job_queue import job_queue
+from modules.metrics import registry, span, render_gauges
+
+logger = logging.getLogger(__name__)
+
 # Check Key
 cred_filename = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 if cred_filename:
@@ -42,34 +58,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-os.makedirs("uploads", exist_ok=True)
+# --- EXECUTION LAYER ---
+# Process pool cho mask (CPU), thread pool cho Vertex / Mongo / file (IO blocking)
+executor = ExecutionLayer()
 
-def cleanup_files(paths: list):
-    for path in paths:
-        try:
-            if os.path.exists(path): os.remove(path)
-        except OSError: pass
+# Số call Vertex AI chạy song song tối đa trong 1 request batch
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "3"))
+
+@app.on_event("startup")
+async def start_worker_pools():
+    await executor.start()
+    # Catalog khóa học trong RAM: tra từ khóa không cần round trip MongoDB
+    await asyncio.to_thread(start_course_catalog)
+    job_queue.start_workers(process_job, retry_on=JOB_RETRY_ERRORS)
+
+@app.on_event("shutdown")
+async def stop_worker_pools():
+    await job_queue.stop_workers()
+    executor.shutdown()
+    course_catalog.stop()
+    close_clients()
+    stop_logging()
+
+def resize_image_standard(image_bytes: bytes, target_size=(1024, 1024)):
+    """Decode ảnh upload 1 lần trong RAM, resize và encode lại 1 lần (không ghi ra disk).
+    Trả về (ảnh BGR đã resize, bytes JPEG) để dùng chung cho mask và Vertex AI."""
+    img_resized = cv2.resize(decode_image(image_bytes), target_size)
+    ok, encoded = cv2.imencode(".jpg", img_resized, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok: raise ValueError("Lỗi encode ảnh")
+    return img_resized, encoded.tobytes()
+
+def decode_image(image_bytes: bytes):
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None: raise ValueError("Lỗi ảnh")
+    return img
 
-def resize_image_standard(image_path: str, target_size=(1024, 1024)):
+async def get_landmarks(image_hash: str, face_image):
+    # Landmark chỉ phụ thuộc ảnh -> cache lại, đổi look chỉ cần vẽ lại mask
+    landmarks = landmark_cache.get(image_hash)
+    if landmarks is None:
+        with span("landmarks"):
+            landmarks = await executor.run_cpu(detect_landmarks, face_image)
+        landmark_cache.put(image_hash, landmarks)
+    return landmarks
+
+def build_full_prompt(prompt_override: str, user_prompt: str) -> str:
+    full_prompt = prompt_override
+    if user_prompt.strip():
+        full_prompt += f", {user_prompt}"
+    return full_prompt
+
+def parse_json_field(value, default):
+    """Field form có thể là chuỗi JSON hoặc đã là object (trong request batch)"""
+    if isinstance(value, (dict, list)): return value
     try:
-        img = cv2.imread(image_path)
-        if img is not None:
-            img_resized = cv2.resize(img, target_size)
-            cv2.imwrite(image_path, img_resized)
-            return True
-    except Exception: pass
-    return False
+        return json.loads(value)
+    except Exception:
+        return default
 
 # --- API 1: TƯ VẤN (Consult) ---
 @app.post("/vto/consult-styles")
 async def consult_styles(user_request: str = Form(...)):
-    styles = await consult_styles_with_gemini(user_request)
+    with span("consult_total"):
+        styles = await consult_styles_with_gemini(user_request)
     return JSONResponse(status_code=200, content={"styles": styles})
 
+# Bản streaming (NDJSON): mỗi dòng là 1 look, gửi ngay khi Gemini sinh xong look đó
+@app.post("/vto/consult-styles/stream")
+async def consult_styles_stream(user_request: str = Form(...)):
+    async def ndjson_lines():
+        async for look in stream_styles_with_gemini(user_request):
+            yield json.dumps(look, ensure_ascii=False) + "\n"
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
 # --- API 2: TẠO ẢNH (Generate) ---
 @app.post("/vto/generate-makeup")
 async def handle_vto_generation(
-    background_tasks: BackgroundTasks,
     user_face: UploadFile = File(...),
     
     prompt_override: str = Form(...),     
@@ -79,69 +143,251 @@ async def handle_vto_generation(
     
     user_prompt: str = Form("")         
 ):
-    print("\n--- NHẬN YÊU CẦU GENERATE  ---")
-    
-    request_id = str(uuid.uuid4())[:8]
-    user_face_path = os.path.join("uploads", f"face_{request_id}.jpg")
-    
-    with open(user_face_path, "wb") as f:
-        shutil.copyfileobj(user_face.file, f)
-    
-    files_to_cleanup = [user_face_path]
-    resize_image_standard(user_face_path)
+    logger.info("--- NHẬN YÊU CẦU GENERATE  ---")
 
     try:
-        settings_dict = {}
-        try:
-            settings_dict = json.loads(technical_settings)
-            print(f"Settings applied: {settings_dict}")
-        except:
-            print("Settings parse error, using default.")
+        with span("generate_total"):
+            raw_bytes = await user_face.read()
+            with span("decode_resize"):
+                face_image, face_bytes = await executor.run_io(resize_image_standard, raw_bytes)
 
-        mask_bytes = create_makeup_mask(
-            image_path=user_face_path,
-            settings=settings_dict
-        )
+            result = await run_generation(
+                face_image, face_bytes,
+                prompt_override, technical_settings, tutorial_override, keywords_override, user_prompt
+            )
+        return JSONResponse(content=result)
+
+    except PoolSaturatedError as e:
+        raise HTTPException(503, detail=str(e))
+
+    except Exception as e:
+        logger.error(f"ERROR: {e}")
+        raise HTTPException(500, detail=str(e))
+
+async def run_generation(
+    face_image,
+    face_bytes: bytes,
+    prompt_override: str,
+    technical_settings: str,
+    tutorial_override: str,
+    keywords_override: str,
+    user_prompt: str
+) -> dict:
+    """Pipeline generate 1 look (dùng chung cho API đồng bộ và job queue)"""
+    settings_dict = {}
+    try:
+        settings_dict = json.loads(technical_settings)
+        logger.info(f"Settings applied: {settings_dict}")
+    except:
+        logger.info("Settings parse error, using default.")
+
+    # Cache: cùng ảnh + cùng settings + cùng prompt -> trả lại kết quả cũ
+    image_hash = hash_image(face_bytes)
+    cache_key = ResultCache.make_key(image_hash, settings_dict, prompt_override, user_prompt)
+    with span("result_cache"):
+        result_base64 = await result_cache.aget(cache_key)
+
+    if result_base64 is None:
+        landmarks = await get_landmarks(image_hash, face_image)
+
+        with span("rasterize"):
+            mask = await executor.run_cpu(
+                rasterize_mask,
+                landmarks=landmarks,
+                image_shape=face_image.shape,
+                settings=settings_dict
+            )
 
         # 3. Tạo Prompt & Gọi AI
-        full_prompt = prompt_override
-        if user_prompt.strip():
-            full_prompt += f", {user_prompt}"
-            
-        result_base64 = generate_inpainted_image(
-            user_image_path=user_face_path,
-            mask_bytes=mask_bytes,
-            prompt=full_prompt,
-            settings=settings_dict 
-        )
-
-        # 4. Tìm khóa học (Dựa trên keywords)
-        final_keywords = []
-        try:
-            final_keywords = json.loads(keywords_override)
-        except: pass
-        
-        suggested_courses = get_courses_from_db(final_keywords)
-        
-        # 5. Trả về course và tutorial
-        final_tutorial = []
-        try:
-            final_tutorial = json.loads(tutorial_override)
-        except: pass
+        with span("vertex"):
+            result_base64 = await executor.run_io(
+                generate_inpainted_image,
+                user_image_bytes=face_bytes,
+                mask=mask,
+                prompt=build_full_prompt(prompt_override, user_prompt),
+                settings=settings_dict 
+            )
+        await result_cache.aput(cache_key, result_base64)
+    else:
+        logger.info("[Cache] HIT -> bỏ qua mask + Vertex AI")
 
-        background_tasks.add_task(cleanup_files, files_to_cleanup)
+    # 4. Tìm khóa học (Dựa trên keywords)
+    final_keywords = []
+    try:
+        final_keywords = json.loads(keywords_override)
+    except: pass
+    
+    with span("db_lookup"):
+        suggested_courses = await get_courses_async(final_keywords)
+    
+    # 5. Trả về course và tutorial
+    final_tutorial = []
+    try:
+        final_tutorial = json.loads(tutorial_override)
+    except: pass
+
+    return {
+        "result_url": result_base64,
+        "tutorials": final_tutorial,     
+        "courses": suggested_courses     
+    }
+
+# --- API 2b: TẠO ẢNH HÀNG LOẠT (1 ảnh, nhiều look) ---
+# `looks`: JSON list, mỗi phần tử {prompt_override, technical_settings, keywords_override, tutorial_override}.
+# Ảnh chỉ decode + chạy FaceMesh 1 lần; kết quả trả về dạng NDJSON theo thứ tự look nào xong trước.
+@app.post("/vto/generate-makeup/batch")
+async def handle_vto_generation_batch(
+    user_face: UploadFile = File(...),
+    looks: str = Form(...),
+    user_prompt: str = Form(""),
+    max_concurrency: int = Form(BATCH_MAX_CONCURRENCY)
+):
+    logger.info("--- NHẬN YÊU CẦU GENERATE (BATCH) ---")
+
+    look_list = parse_json_field(looks, None)
+    if not isinstance(look_list, list) or not look_list or not all(isinstance(l, dict) for l in look_list):
+        raise HTTPException(400, detail="looks phải là JSON list các object")
+
+    try:
+        raw_bytes = await user_face.read()
+        face_image, face_bytes = await executor.run_io(resize_image_standard, raw_bytes)
+        image_hash = hash_image(face_bytes)
+
+        settings_list = [parse_json_field(l.get("technical_settings", {}), {}) for l in look_list]
+        prompts = [l.get("prompt_override", "") for l in look_list]
+        cache_keys = [
+            ResultCache.make_key(image_hash, settings, prompt, user_prompt)
+            for settings, prompt in zip(settings_list, prompts)
+        ]
+        results = await asyncio.gather(*[result_cache.aget(key) for key in cache_keys])
 
-        return JSONResponse(content={
-            "result_url": result_base64,
-            "tutorials": final_tutorial,     
-            "courses": suggested_courses     
-        })
+        # Vẽ toàn bộ mask còn thiếu trong 1 job CPU (landmark dùng chung)
+        masks = {}
+        misses = [i for i, r in enumerate(results) if r is None]
+        if misses:
+            landmarks = await get_landmarks(image_hash, face_image)
+            with span("rasterize_batch"):
+                mask_list = await executor.run_cpu(
+                    rasterize_masks,
+                    landmarks=landmarks,
+                    image_shape=face_image.shape,
+                    settings_list=[settings_list[i] for i in misses]
+                )
+            masks = dict(zip(misses, mask_list))
+
+    except PoolSaturatedError as e:
+        raise HTTPException(503, detail=str(e))
 
     except Exception as e:
-        background_tasks.add_task(cleanup_files, files_to_cleanup)
-        print(f"ERROR: {e}")
+        logger.error(f"ERROR: {e}")
         raise HTTPException(500, detail=str(e))
 
+    # Tìm khóa học: mỗi bộ keyword khác nhau chỉ truy vấn 1 lần
+    keyword_lists = [parse_json_field(l.get("keywords_override", []), []) for l in look_list]
+    keyword_keys = [tuple(str(k) for k in kws) if isinstance(kws, list) else () for kws in keyword_lists]
+    course_tasks = {
+        key: asyncio.ensure_future(get_courses_async(list(key)))
+        for key in set(keyword_keys)
+    }
+
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY)))
+
+    async def run_look(i: int) -> dict:
+        try:
+            result_base64 = results[i]
+            if result_base64 is None:
+                async with semaphore:
+                    with span("vertex"):
+                        result_base64 = await executor.run_io(
+                            generate_inpainted_image,
+                            user_image_bytes=face_bytes,
+                            mask=masks[i],
+                            prompt=build_full_prompt(prompts[i], user_prompt),
+                            settings=settings_list[i]
+                        )
+                await result_cache.aput(cache_keys[i], result_base64)
+
+            return {
+                "index": i,
+                "result_url": result_base64,
+                "tutorials": parse_json_field(look_list[i].get("tutorial_override", []), []),
+                "courses": await course_tasks[keyword_keys[i]]
+            }
+        except Exception as e:
+            logger.error(f"ERROR (look {i}): {e}")
+            return {"index": i, "error": str(e)}
+
+    async def ndjson_lines():
+        for next_done in asyncio.as_completed([run_look(i) for i in range(len(look_list))]):
+            yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+# --- API 2c: JOB QUEUE (submit -> trả job_id ngay, client poll kết quả) ---
+# Lỗi tạm thời: job được xếp lại hàng đợi (backoff) thay vì failed luôn khi gặp đợt request dồn
+JOB_RETRY_ERRORS = (PoolSaturatedError, VertexTransientError, TimeoutError, ConnectionError)
+
+async def process_job(face_bytes: bytes, payload: dict) -> dict:
+    face_image = await executor.run_io(decode_image, face_bytes)
+    return await run_generation(face_image, face_bytes, **payload)
+
+@app.post("/vto/jobs", status_code=202)
+async def submit_generation_job(
+    user_face: UploadFile = File(...),
+    prompt_override: str = Form(...),
+    technical_settings: str = Form(...),
+    tutorial_override: str = Form(...),
+    keywords_override: str = Form(...),
+    user_prompt: str = Form("")
+):
+    try:
+        raw_bytes = await user_face.read()
+        _, face_bytes = await executor.run_io(resize_image_standard, raw_bytes)
+    except PoolSaturatedError as e:
+        raise HTTPException(503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+    payload = {
+        "prompt_override": prompt_override,
+        "technical_settings": technical_settings,
+        "tutorial_override": tutorial_override,
+        "keywords_override": keywords_override,
+        "user_prompt": user_prompt,
+    }
+    job_id = await asyncio.to_thread(job_queue.submit, face_bytes, payload)
+    job_queue.notify()
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+@app.get("/vto/jobs/{job_id}")
+async def get_generation_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None: raise HTTPException(404, detail="Không tìm thấy job")
+    return JSONResponse(content=job)
+
+# --- API 3: THỐNG KÊ (Stats) ---
+async def collect_stats() -> dict:
+    return {
+        "vertex": vertex_client.stats(),
+        "vertex_hedge": hedge_stats(),
+        "result_cache": result_cache.stats(),
+        "landmark_cache": landmark_cache.stats(),
+        "style_cache": style_stats(),
+        "course_catalog": course_catalog.stats(),
+        "jobs": await asyncio.to_thread(job_queue.stats)
+    }
+
+@app.get("/vto/stats")
+async def get_stats():
+    return JSONResponse(content=await collect_stats())
+
+# Prometheus scrape: histogram thời gian từng stage + các số liệu của /vto/stats dạng gauge.
+# Stage chạy trong process pool (FaceMesh, vẽ mask) được đo tại chỗ gọi ở process chính.
+@app.get("/metrics")
+async def get_metrics():
+    body = registry.render() + render_gauges(await collect_stats())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8001))
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
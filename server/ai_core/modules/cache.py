@@ -0,0 +1,244 @@
+import os
+import logging
+import json
+import hashlib
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# --- CẤU HÌNH ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_DISK = os.getenv("RESULT_CACHE_DISK", "false").lower() in ("1", "true", "yes")
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(BASE_DIR, "outputs", "cache"))
+# Pool riêng cho IO của tầng disk (không chen hàng với pool IO gọi Vertex)
+RESULT_CACHE_DISK_WORKERS = int(os.getenv("RESULT_CACHE_DISK_WORKERS", "2"))
+LANDMARK_CACHE_MAX_ENTRIES = int(os.getenv("LANDMARK_CACHE_MAX_ENTRIES", "2048"))
+LANDMARK_CACHE_TTL_SECONDS = float(os.getenv("LANDMARK_CACHE_TTL_SECONDS", "1800"))
+
+
+def hash_image(image_bytes: bytes) -> str:
+    """Hash nội dung ảnh đã chuẩn hoá (dùng làm key cho các cache)"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ByteBudgetLRU:
+    """LRU trong RAM, giới hạn theo tổng số byte của value (không theo số entry)"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size: int):
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self.current_bytes -= old[1]
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """
+    Cache kết quả generate-makeup (chuỗi base64) theo nội dung request.
+    Tầng 1: RAM (LRU theo byte). Tầng 2 (tuỳ chọn): file trong outputs/cache.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, disk_dir: str = None,
+                 disk_max_bytes: int = RESULT_CACHE_DISK_MAX_BYTES):
+        self.memory = ByteBudgetLRU(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_lock = threading.Lock()
+        self._disk_pool = ThreadPoolExecutor(
+            max_workers=RESULT_CACHE_DISK_WORKERS, thread_name_prefix="result-cache-disk"
+        ) if disk_dir else None
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir: os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_hash: str, settings: dict, prompt_override: str, user_prompt: str) -> str:
+        h = hashlib.sha256(image_hash.encode("ascii"))
+        h.update(json.dumps(settings or {}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\x00" + (prompt_override or "").encode("utf-8"))
+        h.update(b"\x00" + (user_prompt or "").strip().encode("utf-8"))
+        return h.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.b64")
+
+    def _count(self, hit: bool, disk: bool = False):
+        with self._stats_lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+            if disk: self.disk_hits += 1
+
+    def _read_disk(self, key: str):
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f: value = f.read()
+            os.utime(path)  # Đánh dấu vừa dùng (LRU theo mtime)
+        except OSError:
+            return None
+        self.memory.put(key, value, len(value))
+        return value
+
+    def _put_disk(self, key: str, value: str):
+        try:
+            self._write_disk(key, value)
+        except OSError as e:
+            logger.error(f"[Cache] Lỗi ghi cache ra disk: {e}")
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.disk_dir:
+            value = self._read_disk(key)
+            if value is not None:
+                self._count(hit=True, disk=True)
+                return value
+        self._count(hit=value is not None)
+        return value
+
+    def put(self, key: str, value: str):
+        self.memory.put(key, value, len(value))
+        if self.disk_dir: self._put_disk(key, value)
+
+    # --- BẢN ASYNC (dùng trong event loop) ---
+    # Tầng RAM tra ngay trên event loop; chỉ IO tầng disk mới đẩy sang pool riêng
+    async def aget(self, key: str):
+        value = self.memory.get(key)
+        if value is None and self.disk_dir:
+            loop = asyncio.get_running_loop()
+            value = await loop.run_in_executor(self._disk_pool, self._read_disk, key)
+            if value is not None:
+                self._count(hit=True, disk=True)
+                return value
+        self._count(hit=value is not None)
+        return value
+
+    async def aput(self, key: str, value: str):
+        self.memory.put(key, value, len(value))
+        if self.disk_dir:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._disk_pool, self._put_disk, key, value)
+
+    def _write_disk(self, key: str, value: str):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: f.write(value)
+        os.replace(tmp_path, path)
+
+        with self._disk_lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.disk_dir):
+                if not entry.name.endswith(".b64"): continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+            # Xoá file cũ nhất cho tới khi về dưới ngân sách
+            for _, size, old_path in sorted(entries):
+                if total <= self.disk_max_bytes: break
+                try:
+                    os.remove(old_path)
+                    total -= size
+                except OSError: pass
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            hits, disk_hits, misses = self.hits, self.disk_hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+            "entries": len(self.memory),
+            "bytes": self.memory.current_bytes,
+            "max_bytes": self.memory.max_bytes,
+            "evictions": self.memory.evictions,
+        }
+
+
+class TTLCache:
+    """Cache trong RAM có TTL, vượt quá số entry thì bỏ entry ít dùng nhất"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires_at, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        }
+
+
+class LandmarkCache(TTLCache):
+    """
+    Cache landmark FaceMesh (mảng float32 478x3) theo hash ảnh.
+    Đổi look trên cùng 1 ảnh chỉ cần vẽ lại mask, không chạy lại FaceMesh.
+    """
+
+    def __init__(self, max_entries: int = LANDMARK_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = LANDMARK_CACHE_TTL_SECONDS):
+        super().__init__(max_entries, ttl_seconds)
+
+
+result_cache = ResultCache(disk_dir=RESULT_CACHE_DIR if RESULT_CACHE_DISK else None)
+landmark_cache = LandmarkCache()
@@ -0,0 +1,180 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from datetime import datetime
+from modules.course_ranking import CourseRanker
+from modules.db import COURSE_CARD_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+# --- CẤU HÌNH ---
+COURSE_CATALOG_ENABLED = os.getenv("COURSE_CATALOG_ENABLED", "true").lower() in ("1", "true", "yes")
+# Poll các khóa học có updatedAt mới (giây)
+COURSE_CATALOG_POLL_SECONDS = float(os.getenv("COURSE_CATALOG_POLL_SECONDS", "30"))
+# Poll không thấy document bị xoá -> định kỳ nạp lại toàn bộ (giây)
+COURSE_CATALOG_FULL_RELOAD_SECONDS = float(os.getenv("COURSE_CATALOG_FULL_RELOAD_SECONDS", "900"))
+FALLBACK_SIZE = 10
+
+# Chỉ lấy các field cần cho tìm kiếm + trả về client
+CATALOG_PROJECTION = {**COURSE_CARD_PROJECTION, "description": 1, "status": 1, "createdAt": 1, "updatedAt": 1}
+
+
+def _sort_time(value) -> float:
+    if isinstance(value, datetime): return value.timestamp()
+    if isinstance(value, (int, float)): return float(value)
+    return 0.0
+
+
+class CourseCatalog:
+    """
+    Bản sao trong RAM các khóa học đã publish + ma trận xếp hạng BM25 (CourseRanker).
+    Tra từ khóa không cần round trip tới MongoDB; danh sách TOP PURCHASED tính sẵn.
+    Cập nhật dần bằng cách poll `updatedAt` (dựng lại ranker khi có thay đổi),
+    nạp lại toàn bộ định kỳ.
+    """
+
+    def __init__(self):
+        self.collection = None
+        self._lock = threading.Lock()
+        self._docs = {}       # id -> document
+        self._order = {}      # id -> thứ tự nạp (giữ thứ tự tự nhiên như find())
+        self._ranker = None
+        self._fallback = []
+        self._next_order = 0
+        self._watermark = None
+        self._loaded_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.load_count = 0
+        self.poll_count = 0
+        self.updated_count = 0
+        self.ready = False
+
+    # --- NẠP / CẬP NHẬT ---
+    def start(self, collection):
+        """Nạp toàn bộ (blocking) rồi chạy thread poll nền"""
+        self.collection = collection
+        self.load()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="course-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def load(self, collection=None):
+        if collection is not None: self.collection = collection
+        start = time.perf_counter()
+        docs = list(self.collection.find({"status": "published"}, CATALOG_PROJECTION))
+        ranker = CourseRanker(docs)
+        with self._lock:
+            self._docs, self._order = {}, {}
+            self._next_order = 0
+            self._watermark = None
+            for doc in docs: self._upsert(doc)
+            self._refresh_fallback()
+            self._ranker = ranker
+            self._loaded_at = time.monotonic()
+            self.load_count += 1
+            self.ready = True
+        logger.info(f"[Catalog] Nạp {len(docs)} khóa học: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def poll(self):
+        """
+        Áp dụng các khóa học có updatedAt >= mốc đã thấy (kể cả khóa bị bỏ publish).
+        Dùng >= để không sót khóa cập nhật cùng thời điểm với mốc, nên các document đã có
+        (không đổi) luôn quay lại -> bỏ qua chúng, chỉ dựng lại ranker khi thật sự có thay đổi.
+        """
+        if self._watermark is None: return self.load()
+        docs = list(self.collection.find({"updatedAt": {"$gte": self._watermark}}, CATALOG_PROJECTION))
+        with self._lock:
+            changed = 0
+            for doc in docs:
+                course_id = str(doc["_id"])
+                self._advance_watermark(doc.get("updatedAt"))
+                if doc.get("status") == "published":
+                    if self._docs.get(course_id) == doc: continue
+                    self._upsert(doc)
+                else:
+                    if course_id not in self._docs: continue
+                    self._remove(course_id)
+                changed += 1
+            self.poll_count += 1
+            self.updated_count += changed
+            if not changed: return
+            self._refresh_fallback()
+            snapshot = [self._docs[i] for i in sorted(self._docs, key=self._order.__getitem__)]
+        # Dựng ranker ngoài lock, request vẫn dùng ranker cũ trong lúc dựng
+        ranker = CourseRanker(snapshot)
+        with self._lock: self._ranker = ranker
+
+    def _refresh_loop(self):
+        while not self._stop.wait(COURSE_CATALOG_POLL_SECONDS):
+            try:
+                if time.monotonic() - self._loaded_at >= COURSE_CATALOG_FULL_RELOAD_SECONDS: self.load()
+                else: self.poll()
+            except Exception as e:
+                logger.error(f"[Catalog] Lỗi cập nhật: {e}")
+
+    def _upsert(self, doc):
+        course_id = str(doc["_id"])
+        self._docs[course_id] = doc
+        if course_id not in self._order:
+            self._order[course_id] = self._next_order
+            self._next_order += 1
+        self._advance_watermark(doc.get("updatedAt"))
+
+    def _advance_watermark(self, updated_at):
+        if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+            self._watermark = updated_at
+
+    def _remove(self, course_id: str):
+        self._docs.pop(course_id, None)
+        self._order.pop(course_id, None)
+
+    def _refresh_fallback(self):
+        # Giống truy vấn fallback cũ: mua nhiều nhất (purchased > 0), bằng nhau lấy mới nhất;
+        # chưa ai mua thì lấy khóa mới nhất
+        def key(course_id):
+            doc = self._docs[course_id]
+            return doc.get("purchased") or 0, _sort_time(doc.get("createdAt"))
+
+        bought = [i for i, d in self._docs.items() if (d.get("purchased") or 0) > 0]
+        if bought:
+            self._fallback = heapq.nlargest(FALLBACK_SIZE, bought, key=key)
+        else:
+            self._fallback = heapq.nlargest(
+                FALLBACK_SIZE, self._docs, key=lambda i: _sort_time(self._docs[i].get("createdAt"))
+            )
+
+    # --- TRA CỨU ---
+    def search(self, keywords: list, limit: int = 3) -> list:
+        """[(document, điểm)] xếp theo BM25 theo field + độ phổ biến (purchased)"""
+        with self._lock: ranker = self._ranker
+        if ranker is None: return []
+        return ranker.rank(keywords, limit)
+
+    def top_purchased(self, limit: int = 3) -> list:
+        with self._lock:
+            return [self._docs[i] for i in self._fallback[:limit]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "courses": len(self._docs),
+                "tokens": len(self._ranker.vocab) if self._ranker is not None else 0,
+                "loads": self.load_count,
+                "polls": self.poll_count,
+                "updated": self.updated_count,
+                "age_seconds": time.monotonic() - self._loaded_at if self.ready else 0.0,
+            }
+
+
+course_catalog = CourseCatalog()
@@ -0,0 +1,124 @@
+import os
+import re
+import math
+import bisect
+import itertools
+import unicodedata
+import numpy as np
+from scipy import sparse
+
+# --- CẤU HÌNH XẾP HẠNG (BM25 theo field) ---
+# Trọng số field: khớp tên khóa học quan trọng hơn khớp trong mô tả
+FIELD_WEIGHTS = {
+    "name": float(os.getenv("COURSE_RANK_WEIGHT_NAME", "3.0")),
+    "tags": float(os.getenv("COURSE_RANK_WEIGHT_TAGS", "2.0")),
+    "description": float(os.getenv("COURSE_RANK_WEIGHT_DESCRIPTION", "1.0")),
+}
+BM25_K1 = float(os.getenv("COURSE_RANK_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("COURSE_RANK_BM25_B", "0.75"))
+# Điểm cuối = điểm BM25 * (1 + POPULARITY_WEIGHT * log1p(purchased) / log1p(max purchased))
+POPULARITY_WEIGHT = float(os.getenv("COURSE_RANK_POPULARITY_WEIGHT", "0.3"))
+# Token từ khóa dài >= mức này khớp thêm các token có cùng tiền tố ("lip" -> "lipstick"), điểm thấp hơn
+PREFIX_MIN_LEN = int(os.getenv("COURSE_RANK_PREFIX_MIN_LEN", "3"))
+PREFIX_MATCH_WEIGHT = float(os.getenv("COURSE_RANK_PREFIX_MATCH_WEIGHT", "0.5"))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Trang điểm" -> "Trang diem" """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text) -> list:
+    if isinstance(text, list): text = " ".join(str(t) for t in text)
+    if not isinstance(text, str): return []
+    return _TOKEN_RE.findall(unicodedata.normalize("NFC", text.lower()))
+
+
+def index_terms(text) -> list:
+    """Token gốc + dạng bỏ dấu (từ khóa không dấu vẫn khớp khóa học có dấu)"""
+    terms = []
+    for token in tokenize(text):
+        terms.append(token)
+        folded = fold_diacritics(token)
+        if folded != token: terms.append(folded)
+    return terms
+
+
+class CourseRanker:
+    """
+    Ma trận điểm BM25 (khóa học x token) dựng 1 lần từ snapshot catalog.
+    Mỗi query chỉ cắt vài cột của ma trận CSC và cộng lại -> chấm điểm toàn bộ catalog.
+    """
+
+    def __init__(self, docs: list):
+        self.docs = docs
+        vocab = {}
+        rows, cols, values = [], [], []
+
+        for field, weight in FIELD_WEIGHTS.items():
+            field_terms = [index_terms(doc.get(field)) for doc in docs]
+            lengths = np.array([len(terms) for terms in field_terms], dtype=np.float32)
+            avg_length = float(lengths.mean()) if len(docs) and lengths.mean() > 0 else 1.0
+
+            for row, terms in enumerate(field_terms):
+                if not terms: continue
+                # Chuẩn hoá độ dài field theo BM25: field dài -> mỗi lần khớp ít giá trị hơn
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[row] / avg_length)
+                counts = {}
+                for term in terms: counts[term] = counts.get(term, 0) + 1
+                for term, tf in counts.items():
+                    rows.append(row)
+                    cols.append(vocab.setdefault(term, len(vocab)))
+                    values.append(weight * tf * (BM25_K1 + 1) / (tf + norm))
+
+        shape = (len(docs), len(vocab))
+        # Trùng (khóa học, token) giữa các field được cộng dồn khi đổi sang CSR
+        tf_matrix = sparse.csr_matrix(
+            (np.array(values, dtype=np.float32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+            shape=shape
+        )
+        doc_freq = np.bincount(tf_matrix.indices, minlength=shape[1])
+        n = len(docs)
+        idf = np.log1p((n - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+        tf_matrix.data *= idf[tf_matrix.indices]
+        self.matrix = tf_matrix.tocsc()
+        self.vocab = vocab
+        self.sorted_vocab = sorted(vocab)
+
+        purchased = np.array([max(float(doc.get("purchased") or 0), 0.0) for doc in docs], dtype=np.float32)
+        top = math.log1p(float(purchased.max())) if n else 0.0
+        popularity = np.log1p(purchased) / top if top > 0 else np.zeros(n, dtype=np.float32)
+        self.boost = (1.0 + POPULARITY_WEIGHT * popularity).astype(np.float32)
+
+    def _query_columns(self, keywords: list):
+        weights = {}
+        for keyword in keywords:
+            for token in tokenize(str(keyword)):
+                col = self.vocab.get(token)
+                if col is not None: weights[col] = max(weights.get(col, 0.0), 1.0)
+                if len(token) < PREFIX_MIN_LEN: continue
+
+                start = bisect.bisect_left(self.sorted_vocab, token)
+                for term in itertools.takewhile(lambda t: t.startswith(token),
+                                                itertools.islice(self.sorted_vocab, start, None)):
+                    if term == token: continue
+                    col = self.vocab[term]
+                    weights[col] = max(weights.get(col, 0.0), PREFIX_MATCH_WEIGHT)
+        return list(weights), np.array(list(weights.values()), dtype=np.float32)
+
+    def rank(self, keywords: list, k: int = 3) -> list:
+        """Trả về [(document, điểm)] của k khóa học điểm cao nhất (chỉ khóa có khớp từ khóa)"""
+        cols, weights = self._query_columns(keywords)
+        if not cols: return []
+
+        scores = (self.matrix[:, cols] @ weights) * self.boost
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        # Điểm giảm dần, bằng điểm thì giữ thứ tự trong catalog
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(self.docs[i], float(scores[i])) for i in candidates]
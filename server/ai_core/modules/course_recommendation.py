@@ -1,27 +1,27 @@
-import os
+import logging
 import re
-from pymongo import MongoClient, DESCENDING
-from dotenv import load_dotenv
+import asyncio
+from pymongo import DESCENDING
+from modules.db import MONGO_URI, DB_NAME, COURSE_CARD_PROJECTION, get_collection, get_async_collection
+from modules.metrics import span
+from modules.course_catalog import course_catalog, COURSE_CATALOG_ENABLED
 
-# Load môi trường để lấy chuỗi kết nối
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 # --- CẤU HÌNH DATABASE ---
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("DB_NAME")
-
+# Client + connection pool dùng chung ở modules/db.py (pymongo lazy, chưa kết nối tới lúc truy vấn)
 courses_collection = None
+async_courses_collection = None  # Motor; None nếu chưa cài motor -> chạy bản sync qua thread
 
 if not MONGO_URI:
-    print("❌ [Module Course] CẢNH BÁO: Chưa có MONGO_URI trong file .env")
+    logger.warning("❌ [Module Course] CẢNH BÁO: Chưa có MONGO_URI trong file .env")
 else:
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        courses_collection = db["courses"]
-        print(f"[Module Course] Đã kết nối MongoDB: {DB_NAME}")
+        courses_collection = get_collection("courses")
+        async_courses_collection = get_async_collection("courses")
+        logger.info(f"[Module Course] Đã kết nối MongoDB: {DB_NAME}")
     except Exception as e:
-        print(f"[Module Course] Lỗi kết nối MongoDB: {e}")
+        logger.error(f"[Module Course] Lỗi kết nối MongoDB: {e}")
 
 # --- CÁC HÀM XỬ LÝ LOGIC ---
 
@@ -57,68 +57,88 @@ def clean_mongo_doc(doc):
         "thumbnail": thumb_url
     }
 
-def get_courses_from_db(keywords: list):
+def start_course_catalog():
+    """Nạp catalog khóa học vào RAM (gọi lúc startup). Lỗi -> vẫn truy vấn thẳng MongoDB"""
+    if courses_collection is None or not COURSE_CATALOG_ENABLED: return
+    try:
+        course_catalog.start(courses_collection)
+    except Exception as e:
+        logger.error(f"[Catalog] Không nạp được catalog, dùng truy vấn MongoDB: {e}")
+
+def _query_plan(keywords: list):
+    """Các truy vấn thử lần lượt, truy vấn đầu tiên có kết quả được dùng: (tên stage, filter, sort)"""
+    # BƯỚC 1: Tìm kiếm theo từ khóa (Keyword Matching)
+    if keywords:
+        regex_list = [re.compile(re.escape(k), re.IGNORECASE) for k in keywords]
+        # --- CẢI TIẾN: Dùng toán tử $or để tìm rộng hơn ---
+        yield "db.keyword_query", {
+            "$or": [
+                {"tags": {"$in": regex_list}}, # Tìm trong tags
+                {"name": {"$in": regex_list}}, # Tìm trong tên khóa học
+                {"description": {"$in": regex_list}} # Tìm trong mô tả khóa học
+            ],
+            "status": "published" # Chỉ lấy khóa học đã public
+        }, None
+
+    # BƯỚC 2: FALLBACK - TOP PURCHASED (Nếu Bước 1 rỗng)
+    # Sort: Mua nhiều nhất lên đầu, nếu bằng nhau thì lấy mới nhất
+    yield "db.fallback_query", {"status": "published", "purchased": {"$gt": 0}}, \
+        [("purchased", DESCENDING), ("createdAt", DESCENDING)]
+
+    # Nếu website chưa ai mua gì cả, thì lấy khóa mới nhất
+    yield "db.newest_query", {"status": "published"}, [("createdAt", DESCENDING)]
+
+def _search_catalog(keywords: list, limit: int) -> list:
+    with span("db.catalog_lookup"):
+        ranked = course_catalog.search(keywords, limit) if keywords else []
+        if not ranked: return _clean_results(course_catalog.top_purchased(limit))
+
+    clean_list = _clean_results([doc for doc, _ in ranked])
+    for item, (_, score) in zip(clean_list, ranked): item["score"] = round(score, 4)
+    return clean_list
+
+def get_courses_from_db(keywords: list, limit: int = 3):
     """
     Cải tiến: Tìm kiếm đa trường (Tags + Tên khóa học)
+    Catalog đã nạp -> xếp hạng BM25 trong RAM (kèm "score"), chưa nạp -> truy vấn MongoDB
     """
+    if course_catalog.ready: return _search_catalog(keywords, limit)
     if courses_collection is None: return []
-    
-    print(f"\n [DB] Tìm kiếm khóa học với: {keywords}")
-    
-    raw_results = []
 
-    # BƯỚC 1: Tìm kiếm theo từ khóa (Keyword Matching)
-    if keywords:
+    logger.info(f"[DB] Tìm kiếm khóa học với: {keywords}")
+    for stage, query, sort in _query_plan(keywords):
         try:
-            # Tạo Regex list
-            regex_list = [re.compile(re.escape(k), re.IGNORECASE) for k in keywords]
-            
-            # --- CẢI TIẾN: Dùng toán tử $or để tìm rộng hơn ---
-            query = {
-                "$or": [
-                    {"tags": {"$in": regex_list}}, # Tìm trong tags
-                    {"name": {"$in": regex_list}}, # Tìm trong tên khóa học
-                    {"description": {"$in": regex_list}} # Tìm trong mô tả khóa học
-                ],
-                "status": "published" # Chỉ lấy khóa học đã public
-            }
-            
-            cursor = courses_collection.find(query).limit(3)
-            raw_results = list(cursor)
-            print(f"[DB] Tìm thấy: {len(raw_results)} khóa học")
+            with span(stage):
+                cursor = courses_collection.find(query, COURSE_CARD_PROJECTION)
+                if sort: cursor = cursor.sort(sort)
+                raw_results = list(cursor.limit(limit))
         except Exception as e:
-            print(f"[DB] Lỗi truy vấn: {e}")
+            logger.error(f"[DB] Lỗi truy vấn ({stage}): {e}")
+            continue
+        if raw_results:
+            logger.info(f"[DB] {stage}: {len(raw_results)} khóa học")
+            return _clean_results(raw_results)
+    return []
 
-    # BƯỚC 2: FALLBACK - TOP PURCHASED (Nếu Bước 1 rỗng)
-    if not raw_results:
-        print("[DB] Không khớp từ khóa -> Chạy Fallback: TOP PURCHASED")
+async def get_courses_async(keywords: list, limit: int = 3):
+    """Bản async cho handler FastAPI: catalog trong RAM, hoặc Motor, hoặc bản sync qua thread"""
+    if course_catalog.ready: return _search_catalog(keywords, limit)
+    if async_courses_collection is None:
+        return await asyncio.to_thread(get_courses_from_db, keywords, limit)
+
+    for stage, query, sort in _query_plan(keywords):
         try:
-            # 1. status: "published"
-            # 2. purchased: { $gt: 0 } (Chỉ lấy khóa đã có người mua)
-            # 3. sort: purchased giảm dần (-1)
-            
-            fallback_query = {
-                "status": "published",
-                "purchased": {"$gt": 0} 
-            }
-            
-            # Sort: Mua nhiều nhất lên đầu, nếu bằng nhau thì lấy mới nhất
-            cursor = courses_collection.find(fallback_query)\
-                .sort([("purchased", DESCENDING), ("createdAt", DESCENDING)])\
-                .limit(3)
-                
-            raw_results = list(cursor)
-            
-            # Nếu website chưa ai mua gì cả, thì lấy 3 khóa mới nhất
-            if not raw_results:
-                print("[DB] Chưa có lượt mua nào -> Lấy khóa học mới nhất")
-                cursor_backup = courses_collection.find({"status": "published"})\
-                    .sort("createdAt", DESCENDING).limit(3)
-                raw_results = list(cursor_backup)
-                
+            with span(stage):
+                cursor = async_courses_collection.find(query, COURSE_CARD_PROJECTION)
+                if sort: cursor = cursor.sort(sort)
+                raw_results = await cursor.limit(limit).to_list(limit)
         except Exception as e:
-            print(f"[DB] Lỗi Fallback: {e}")
+            logger.error(f"[DB] Lỗi truy vấn ({stage}): {e}")
+            continue
+        if raw_results: return _clean_results(raw_results)
+    return []
 
+def _clean_results(raw_results: list) -> list:
     # 3. Clean Data
     clean_list = []
     seen_ids = set()
@@ -0,0 +1,372 @@
+import os
+import sys
+import resource
+from array import array
+import numpy as np
+from scipy import sparse
+
+# --- ĐỘ TƯƠNG ĐỒNG KHÓA HỌC (ITEM-ITEM COSINE) ---
+# Mỗi khóa học là 1 vector nhị phân theo user (1 = đã học). Cosine giữa 2 khóa:
+#   số user học chung / sqrt(số user khóa A * số user khóa B)
+TOP_K = 5
+
+
+def build_item_user_matrix(user_codes: np.ndarray, course_codes: np.ndarray,
+                           n_users: int, n_courses: int) -> sparse.csr_matrix:
+    """Ma trận thưa khóa học x user từ mã số nguyên (trùng (user, khóa) chỉ tính 1 lần)"""
+    matrix = sparse.csr_matrix(
+        (np.ones(len(user_codes), dtype=np.float32), (course_codes, user_codes)),
+        shape=(n_courses, n_users)
+    )
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def cooccurrence(item_user: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Số user học chung từng cặp khóa học (chỉ lưu các cặp > 0)"""
+    return (item_user @ item_user.T).tocsr()
+
+
+def top_k_from_cooccurrence(cooc: sparse.csr_matrix, counts: np.ndarray, k: int = TOP_K, rows=None,
+                            row_courses: np.ndarray = None):
+    """
+    Top-k khóa giống nhất cho các hàng `rows` (mặc định: tất cả), bỏ qua chính nó.
+    row_courses: mã khóa của từng hàng cooc khi cooc chỉ gồm 1 phần các hàng (mặc định: hàng i là khóa i).
+    Trả về (neighbors int32 [n, k], scores float32 [n, k]); ô trống: neighbor = -1, score = 0.
+    """
+    if rows is None: rows = np.arange(cooc.shape[0])
+    norms = np.sqrt(counts.astype(np.float64))
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+
+    for out, i in enumerate(rows):
+        start, end = cooc.indptr[i], cooc.indptr[i + 1]
+        course = i if row_courses is None else row_courses[i]
+        cols = cooc.indices[start:end]
+        keep = cols != course
+        cols = cols[keep]
+        if not len(cols): continue
+
+        row_scores = cooc.data[start:end][keep] / (norms[course] * norms[cols])
+        if len(cols) > k:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            cols, row_scores = cols[top], row_scores[top]
+        # Điểm giảm dần, bằng điểm thì khóa có mã nhỏ hơn đứng trước
+        order = np.lexsort((cols, -row_scores))
+        neighbors[out, :len(order)] = cols[order]
+        scores[out, :len(order)] = row_scores[order]
+    return neighbors, scores
+
+
+def cosine_top_k(item_user: sparse.csr_matrix, k: int = TOP_K):
+    counts = np.asarray(item_user.sum(axis=1)).ravel()
+    return top_k_from_cooccurrence(cooccurrence(item_user), counts, k)
+
+
+# --- BACKEND TÌM KHÓA GIỐNG NHẤT ---
+# exact:   X·Xᵀ một lần (giữ toàn bộ cooc, cần cho chế độ incremental)
+# blocked: vẫn chính xác, nhưng tính X·Xᵀ theo khối BLOCK_SIZE hàng -> bộ nhớ ~ BLOCK_SIZE x số khóa
+# minhash: MinHash tập user của từng khóa + LSH theo band -> chỉ tính cosine chính xác cho cặp ứng viên.
+#          THỬ NGHIỆM: với band đủ để đạt recall, số cặp ứng viên rất lớn -> chậm và tốn RAM hơn blocked
+#          (100k khóa / 1M enrollment: minhash 43.4s, ~900 MB; blocked 19.5s, 22 MB). Mặc định dùng blocked.
+BLOCK_SIZE = 2048
+MINHASH_PERMUTATIONS = 128
+# 1 hàng / band: 2 khóa thành ứng viên khi trùng min-hash ở ít nhất 1 trong 128 hoán vị, xác suất 1-(1-J)^128
+# (Jaccard J = 0.02 -> 92%). Cosine top-k thường là cặp Jaccard thấp (khóa nhỏ - khóa phổ biến), nên band nhiều
+# hàng hơn (vd 64 band x 2 hàng) chỉ đạt recall@5 ~0.1-0.8 trên dữ liệu thử
+MINHASH_BANDS = 128
+# Bucket LSH quá đông (khóa ít user trùng chữ ký) -> mỗi khóa chỉ ghép với MINHASH_MAX_BUCKET - 1 khóa kề
+MINHASH_MAX_BUCKET = 64
+_HASH_PRIME = (1 << 31) - 1
+_HASH_CHUNK_CELLS = 4_000_000  # số ô (enrollment x hàm băm) tối đa mỗi lượt tính chữ ký
+
+
+def blocked_top_k(item_user: sparse.csr_matrix, k: int = TOP_K, block_size: int = BLOCK_SIZE):
+    counts = np.asarray(item_user.sum(axis=1)).ravel()
+    user_item = item_user.T.tocsr()
+    n_courses = item_user.shape[0]
+    neighbors = np.full((n_courses, k), -1, dtype=np.int32)
+    scores = np.zeros((n_courses, k), dtype=np.float32)
+    for start in range(0, n_courses, block_size):
+        end = min(start + block_size, n_courses)
+        block = (item_user[start:end] @ user_item).tocsr()
+        neighbors[start:end], scores[start:end] = top_k_from_cooccurrence(
+            block, counts, k, row_courses=np.arange(start, end)
+        )
+    return neighbors, scores
+
+
+def exact_top_k_for(item_user: sparse.csr_matrix, courses: np.ndarray, k: int = TOP_K):
+    """Top-k chính xác chỉ cho các khóa `courses` (dùng để đo recall trên mẫu)"""
+    counts = np.asarray(item_user.sum(axis=1)).ravel()
+    block = (item_user[courses] @ item_user.T).tocsr()
+    return top_k_from_cooccurrence(block, counts, k, row_courses=courses)
+
+
+def minhash_signatures(item_user: sparse.csr_matrix, num_perm: int = MINHASH_PERMUTATIONS,
+                       seed: int = 0) -> np.ndarray:
+    """Chữ ký MinHash [số khóa, num_perm] với h(u) = (a*u + b) mod p. Khóa không có user: giữ giá trị max"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _HASH_PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, _HASH_PRIME, size=num_perm, dtype=np.int64)
+    signatures = np.full((item_user.shape[0], num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+    nonempty = np.diff(item_user.indptr) > 0
+    if not nonempty.any(): return signatures
+    starts = item_user.indptr[:-1][nonempty]
+    users = item_user.indices.astype(np.int64)[:, None]
+    step = max(1, min(num_perm, _HASH_CHUNK_CELLS // len(users)))
+    for j in range(0, num_perm, step):
+        hashed = (users * a[j:j + step] + b[j:j + step]) % _HASH_PRIME
+        signatures[nonempty, j:j + step] = np.minimum.reduceat(hashed, starts, axis=0)
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, courses: np.ndarray, bands: int = MINHASH_BANDS,
+                        max_bucket: int = MINHASH_MAX_BUCKET):
+    """Cặp (i < j) trùng chữ ký ở ít nhất 1 band, không trùng lặp"""
+    rows_per_band = signatures.shape[1] // bands
+    n_courses = signatures.shape[0]
+    found = []
+    for band in range(bands):
+        key = np.zeros(len(courses), dtype=np.uint64)
+        for col in range(band * rows_per_band, (band + 1) * rows_per_band):
+            key = key * np.uint64(1_000_003) ^ signatures[courses, col].astype(np.uint64)
+        order = np.argsort(key, kind="stable")
+        key, members = key[order], courses[order]
+        # Khóa cùng bucket nằm liền nhau sau khi sort -> ghép với các khóa cách d vị trí
+        for d in range(1, max_bucket):
+            same = key[d:] == key[:-d]
+            if not same.any(): break
+            i, j = members[:-d][same], members[d:][same]
+            found.append(np.minimum(i, j).astype(np.int64) * n_courses + np.maximum(i, j))
+    if not found: return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    pairs = np.unique(np.concatenate(found))
+    return (pairs // n_courses).astype(np.int32), (pairs % n_courses).astype(np.int32)
+
+
+def minhash_top_k(item_user: sparse.csr_matrix, k: int = TOP_K, num_perm: int = MINHASH_PERMUTATIONS,
+                  bands: int = MINHASH_BANDS, max_bucket: int = MINHASH_MAX_BUCKET, seed: int = 0):
+    """Top-k gần đúng: chỉ khóa ứng viên từ LSH, điểm vẫn là cosine chính xác"""
+    if num_perm % bands: raise ValueError("num_perm phải chia hết cho bands")
+    counts = np.asarray(item_user.sum(axis=1)).ravel()
+    signatures = minhash_signatures(item_user, num_perm, seed)
+    rows, cols = lsh_candidate_pairs(signatures, np.flatnonzero(counts > 0).astype(np.int32), bands, max_bucket)
+
+    # Số user học chung của từng cặp ứng viên, theo lô có tổng số enrollment của 2 khóa <= _HASH_CHUNK_CELLS
+    shared = np.empty(len(rows), dtype=np.float32)
+    cells = np.cumsum(counts[rows] + counts[cols])
+    start = 0
+    while start < len(rows):
+        end = max(start + 1, int(np.searchsorted(cells, cells[start] + _HASH_CHUNK_CELLS)))
+        shared[start:end] = np.asarray(
+            item_user[rows[start:end]].multiply(item_user[cols[start:end]]).sum(axis=1)
+        ).ravel()
+        start = end
+    keep = shared > 0
+    rows, cols, shared = rows[keep], cols[keep], shared[keep]
+
+    n_courses = item_user.shape[0]
+    cooc = sparse.csr_matrix(
+        (np.concatenate([shared, shared]), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+        shape=(n_courses, n_courses)
+    )
+    return top_k_from_cooccurrence(cooc, counts, k)
+
+
+NEIGHBOR_BACKENDS = {"exact": cosine_top_k, "blocked": blocked_top_k, "minhash": minhash_top_k}
+
+
+def find_neighbors(item_user: sparse.csr_matrix, k: int = TOP_K, backend: str = "exact", **options):
+    """Top-k theo backend trong NEIGHBOR_BACKENDS; options là tham số riêng của backend đó"""
+    if backend not in NEIGHBOR_BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn {', '.join(NEIGHBOR_BACKENDS)})")
+    return NEIGHBOR_BACKENDS[backend](item_user, k, **options)
+
+
+def recall_at_k(exact_neighbors: np.ndarray, exact_scores: np.ndarray, scores: np.ndarray) -> float:
+    """
+    Recall@k so với kết quả chính xác, tính trên các khóa có ít nhất 1 khóa tương tự.
+    Điểm của mọi backend là cosine chính xác, nên 1 khóa tìm được tính là đúng khi điểm không thấp hơn
+    điểm thứ k của bản chính xác (bằng điểm ở biên top-k thì chọn khóa nào cũng đúng).
+    """
+    valid = exact_neighbors >= 0
+    truth = valid.sum(axis=1)
+    threshold = np.where(valid, exact_scores, np.inf).min(axis=1)
+    hits = np.minimum(((scores > 0) & (scores >= threshold[:, None] - 1e-6)).sum(axis=1), truth)
+    total = truth.sum()
+    return float(hits.sum() / total) if total else 1.0
+
+
+def sampled_recall_at_k(item_user: sparse.csr_matrix, scores: np.ndarray, k: int = TOP_K,
+                        sample_size: int = 1000, seed: int = 0) -> float:
+    """Recall@k trên mẫu ngẫu nhiên `sample_size` khóa có user (rẻ hơn nhiều so với tính exact toàn bộ)"""
+    courses = np.flatnonzero(np.diff(item_user.indptr) > 0)
+    if len(courses) > sample_size:
+        courses = np.sort(np.random.default_rng(seed).choice(courses, sample_size, replace=False))
+    exact_neighbors, exact_scores = exact_top_k_for(item_user, courses, k)
+    return recall_at_k(exact_neighbors, exact_scores, scores[courses])
+
+
+def peak_memory_mb() -> float:
+    """Bộ nhớ đỉnh (RSS) của process tới thời điểm gọi"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# --- MÃ HOÁ ENROLLMENT THEO LÔ ---
+class EnrollmentEncoder:
+    """
+    Mã hoá userId / courseId -> số nguyên liên tục qua dict tăng dần, từng lô một.
+    Mã được nối vào array kiểu C (4 byte / phần tử), không giữ lại document hay DataFrame.
+    Truyền sẵn danh sách id (từ SimilarityState) để mã mới nối tiếp mã cũ.
+    """
+
+    def __init__(self, user_ids: list = None, course_ids: list = None):
+        self.user_ids = user_ids if user_ids is not None else []
+        self.course_ids = course_ids if course_ids is not None else []
+        self._user_index = {u: i for i, u in enumerate(self.user_ids)}
+        self._course_index = {c: i for i, c in enumerate(self.course_ids)}
+        self._user_codes = array("i")
+        self._course_codes = array("i")
+        self.latest = None  # lastId (_id enrollment) lớn nhất đã thấy
+
+    def add(self, docs: list):
+        user_index, course_index = self._user_index, self._course_index
+        for doc in docs:
+            user_id, course_id = str(doc["userId"]), str(doc["courseId"])
+            code = user_index.get(user_id)
+            if code is None:
+                code = user_index[user_id] = len(self.user_ids)
+                self.user_ids.append(user_id)
+            self._user_codes.append(code)
+
+            code = course_index.get(course_id)
+            if code is None:
+                code = course_index[course_id] = len(self.course_ids)
+                self.course_ids.append(course_id)
+            self._course_codes.append(code)
+
+            last_id = doc.get("lastId")
+            if last_id is not None and (self.latest is None or last_id > self.latest):
+                self.latest = last_id
+
+    def __len__(self):
+        return len(self._user_codes)
+
+    def codes(self):
+        """(mã user, mã khóa học) dạng int32, dùng chung bộ nhớ với array (không copy)"""
+        return (np.frombuffer(self._user_codes, dtype=np.int32),
+                np.frombuffer(self._course_codes, dtype=np.int32))
+
+
+# --- TRẠNG THÁI CHO CHẾ ĐỘ INCREMENTAL ---
+class SimilarityState:
+    """
+    Toàn bộ dữ liệu cần để cập nhật dần độ tương đồng, lưu ra 1 file .npz:
+    - mã hoá id (user / khóa học -> số nguyên), cặp (user, khóa) đã thấy (ma trận user x khóa học)
+    - số user mỗi khóa (counts) + số user học chung từng cặp khóa (cooc)
+    - top-k đã ghi lần trước (chỉ ghi lại khóa có top-k thay đổi)
+    - watermark: thời điểm trong _id lớn nhất của enrollment đã đọc (epoch giây, UTC)
+    """
+
+    def __init__(self, user_ids: list, course_ids: list, user_course: sparse.csr_matrix,
+                 cooc: sparse.csr_matrix, counts: np.ndarray, neighbors: np.ndarray,
+                 scores: np.ndarray, watermark: float):
+        self.user_ids = user_ids
+        self.course_ids = course_ids
+        self.user_course = user_course
+        self.cooc = cooc
+        self.counts = counts
+        self.neighbors = neighbors
+        self.scores = scores
+        self.watermark = watermark
+
+    @classmethod
+    def build(cls, user_ids: list, course_ids: list, user_codes: np.ndarray, course_codes: np.ndarray,
+              watermark: float, k: int = TOP_K):
+        """Tính lại từ đầu (chế độ full)"""
+        item_user = build_item_user_matrix(user_codes, course_codes, len(user_ids), len(course_ids))
+        counts = np.asarray(item_user.sum(axis=1)).ravel().astype(np.int64)
+        cooc = cooccurrence(item_user)
+        neighbors, scores = top_k_from_cooccurrence(cooc, counts, k)
+        return cls(user_ids, course_ids, item_user.T.tocsr(), cooc, counts, neighbors, scores, watermark)
+
+    def encoder(self) -> EnrollmentEncoder:
+        """Encoder nối tiếp mã hiện có (id mới được thêm thẳng vào user_ids / course_ids)"""
+        return EnrollmentEncoder(self.user_ids, self.course_ids)
+
+    def apply(self, user_codes: np.ndarray, course_codes: np.ndarray, watermark: float) -> np.ndarray:
+        """
+        Thêm enrollment mới (mã từ self.encoder()), cập nhật counts / cooc và top-k
+        của các khóa bị ảnh hưởng. Trả về mã các khóa có top-k thay đổi.
+        """
+        k = self.neighbors.shape[1]
+        n_users, n_courses = len(self.user_ids), len(self.course_ids)
+        self.watermark = max(self.watermark, watermark)
+
+        # Khóa / user mới -> mở rộng ma trận
+        self.user_course.resize((n_users, n_courses))
+        self.cooc.resize((n_courses, n_courses))
+        self.counts = np.concatenate([self.counts, np.zeros(n_courses - len(self.counts), dtype=np.int64)])
+        grow = n_courses - len(self.neighbors)
+        self.neighbors = np.vstack([self.neighbors, np.full((grow, k), -1, dtype=np.int32)])
+        self.scores = np.vstack([self.scores, np.zeros((grow, k), dtype=np.float32)])
+
+        # Bỏ cặp đã có (watermark đọc chồng lấn, hoặc enroll trùng)
+        pairs = np.unique(user_codes.astype(np.int64) * n_courses + course_codes)
+        user_codes, course_codes = (pairs // n_courses).astype(np.int32), (pairs % n_courses).astype(np.int32)
+        if len(pairs):
+            seen = np.asarray(self.user_course[user_codes, course_codes]).ravel() > 0
+            user_codes, course_codes = user_codes[~seen], course_codes[~seen]
+        if not len(user_codes): return np.empty(0, dtype=np.int32)
+
+        # cooc mới = (X + D)^T (X + D) = cooc + D^T X + X^T D + D^T D, chỉ cần hàng của user có enroll mới
+        added = sparse.csr_matrix(
+            (np.ones(len(user_codes), dtype=np.float32), (user_codes, course_codes)), shape=(n_users, n_courses)
+        )
+        affected_users = np.unique(user_codes)
+        old_rows, new_rows = self.user_course[affected_users], added[affected_users]
+        cross = new_rows.T @ old_rows
+        self.cooc = (self.cooc + cross + cross.T + new_rows.T @ new_rows).tocsr()
+        self.user_course = (self.user_course + added).tocsr()
+        self.counts += np.bincount(course_codes, minlength=n_courses)
+
+        # Khóa đổi số user -> cosine với mọi khóa học chung đều đổi
+        changed_counts = np.unique(course_codes)
+        candidates = np.unique(np.concatenate([changed_counts] + [
+            self.cooc.indices[self.cooc.indptr[c]:self.cooc.indptr[c + 1]] for c in changed_counts
+        ]))
+        neighbors, scores = top_k_from_cooccurrence(self.cooc, self.counts, k, rows=candidates)
+        differs = (neighbors != self.neighbors[candidates]).any(axis=1) | \
+                  (np.abs(scores - self.scores[candidates]) > 1e-6).any(axis=1)
+        self.neighbors[candidates], self.scores[candidates] = neighbors, scores
+        return candidates[differs].astype(np.int32)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                user_ids=np.array(self.user_ids, dtype=str), course_ids=np.array(self.course_ids, dtype=str),
+                uc_indptr=self.user_course.indptr, uc_indices=self.user_course.indices,
+                cooc_data=self.cooc.data, cooc_indptr=self.cooc.indptr, cooc_indices=self.cooc.indices,
+                counts=self.counts, neighbors=self.neighbors, scores=self.scores,
+                watermark=np.array(self.watermark),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as f:
+            n_users, n_courses = len(f["user_ids"]), len(f["course_ids"])
+            user_course = sparse.csr_matrix(
+                (np.ones(len(f["uc_indices"]), dtype=np.float32), f["uc_indices"], f["uc_indptr"]),
+                shape=(n_users, n_courses)
+            )
+            cooc = sparse.csr_matrix(
+                (f["cooc_data"], f["cooc_indices"], f["cooc_indptr"]), shape=(n_courses, n_courses)
+            )
+            return cls(f["user_ids"].tolist(), f["course_ids"].tolist(), user_course, cooc,
+                       f["counts"], f["neighbors"], f["scores"], float(f["watermark"]))
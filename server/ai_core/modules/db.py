@@ -0,0 +1,84 @@
+import os
+import threading
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- CẤU HÌNH KẾT NỐI (dùng chung cho API, job tính similarity, script) ---
+MONGO_URI = os.getenv("MONGO_URI") or os.getenv("MONGODB_URI")
+DB_NAME = os.getenv("DB_NAME", "test")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Atlas không chọn được server sau mức này -> lỗi ngay thay vì treo request 30s (mặc định pymongo)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+# Đọc catalog khóa học chấp nhận dữ liệu trễ vài giây -> ưu tiên primary, lỗi thì đọc secondary
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primaryPreferred")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "vto-ai-core")
+
+# Các field clean_mongo_doc cần (không kéo courseData, reviews, videoDemo...)
+COURSE_CARD_PROJECTION = {
+    "name": 1, "price": 1, "estimatedPrice": 1, "purchased": 1, "tags": 1, "thumbnail": 1,
+}
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _client_options() -> dict:
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "appname": MONGO_APP_NAME,
+    }
+
+
+def get_client(uri: str = None, **overrides) -> MongoClient:
+    """1 MongoClient (kèm connection pool) cho mỗi URI, dùng chung trong cả process"""
+    uri = uri or MONGO_URI
+    if not uri: raise RuntimeError("Chưa có MONGO_URI trong file .env")
+    with _lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = _clients[uri] = MongoClient(uri, **{**_client_options(), **overrides})
+        return client
+
+
+def get_db(name: str = None, uri: str = None):
+    return get_client(uri)[name or DB_NAME]
+
+
+def get_collection(name: str, db_name: str = None, uri: str = None):
+    return get_db(db_name, uri)[name]
+
+
+def get_async_collection(name: str, db_name: str = None, uri: str = None):
+    """Collection Motor (async) cho handler FastAPI. Chưa cài `motor` -> None (gọi bản sync qua thread)"""
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        return None
+
+    uri = uri or MONGO_URI
+    if not uri: return None
+    with _lock:
+        client = _async_clients.get(uri)
+        if client is None:
+            client = _async_clients[uri] = AsyncIOMotorClient(uri, **_client_options())
+    return client[db_name or DB_NAME][name]
+
+
+def close_clients():
+    with _lock:
+        for client in list(_clients.values()) + list(_async_clients.values()): client.close()
+        _clients.clear()
+        _async_clients.clear()
@@ -0,0 +1,97 @@
+import os
+import logging
+import asyncio
+import time
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from modules.face_masking import init_face_mesh_worker
+from modules.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# --- CẤU HÌNH ---
+# CPU pool: xử lý ảnh / mask (mỗi process giữ 1 FaceMesh riêng)
+# IO pool: các call blocking (Vertex AI, MongoDB, đọc/ghi file)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or os.cpu_count() or 1
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+# Số request tối đa được xếp hàng chờ mỗi pool, vượt quá sẽ trả lỗi 503
+MAX_QUEUED_PER_POOL = int(os.getenv("MAX_QUEUED_PER_POOL", "64"))
+
+
+class PoolSaturatedError(Exception):
+    """Hàng đợi của pool đã đầy"""
+    pass
+
+
+class BoundedPool:
+    """Bọc 1 executor: giới hạn số task đang chạy (= số worker) và số task chờ"""
+
+    def __init__(self, name: str, executor, max_running: int, max_queued: int):
+        self.name = name
+        self.executor = executor
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(max_running)
+        self._queued = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self._slots.locked() and self._queued >= self.max_queued:
+            raise PoolSaturatedError(f"{self.name} pool đang quá tải")
+
+        self._queued += 1
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        # Thời gian chờ slot trống: tăng dần khi pool bị dồn
+        registry.observe(f"pool_wait.{self.name}", time.perf_counter() - start)
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ExecutionLayer:
+    def __init__(self, cpu_workers: int = CPU_WORKERS, io_workers: int = IO_WORKERS,
+                 max_queued: int = MAX_QUEUED_PER_POOL):
+        self.cpu_workers = cpu_workers
+        self.io_workers = io_workers
+        self.max_queued = max_queued
+        self.cpu = None
+        self.io = None
+
+    async def start(self):
+        """Gọi trong event startup (cần event loop đang chạy)"""
+        # "spawn" để process con không kế thừa thread nội bộ của OpenCV / uvicorn
+        cpu_executor = ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_face_mesh_worker
+        )
+        # Warm: submit đủ task cùng lúc để pool sinh toàn bộ process (mỗi process load FaceMesh 1 lần)
+        # Chờ bằng await -> event loop không bị chặn trong lúc các process khởi động
+        await asyncio.gather(*[
+            asyncio.wrap_future(cpu_executor.submit(init_face_mesh_worker)) for _ in range(self.cpu_workers)
+        ])
+
+        io_executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="io")
+
+        self.cpu = BoundedPool("cpu", cpu_executor, self.cpu_workers, self.max_queued)
+        self.io = BoundedPool("io", io_executor, self.io_workers, self.max_queued)
+        logger.info(f"[Execution] CPU pool: {self.cpu_workers} process, IO pool: {self.io_workers} thread")
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        return await self.cpu.run(fn, *args, **kwargs)
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self.io.run(fn, *args, **kwargs)
+
+    def shutdown(self):
+        for pool in (self.cpu, self.io):
+            if pool is not None: pool.shutdown()
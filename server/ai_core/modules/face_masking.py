@@ -1,9 +1,43 @@
+import os
+import math
+import threading
+import itertools
 import cv2
 import mediapipe as mp
 import numpy as np
+from modules.metrics import span
 
 mp_face_mesh = mp.solutions.face_mesh
 
+# --- CẤU HÌNH RENDER MASK ---
+# Cấu hình dùng thật: MASK_RENDER_SCALE=1.0 + MASK_BLUR_MODE "gaussian" (mặc định, như cũ) hoặc "box"
+# (3 lần box blur xấp xỉ Gaussian, nhanh ~3.8x, sai số so với gaussian: trung bình 0.21, tối đa 13 / 255).
+# MASK_RENDER_SCALE < 1 (vẽ + blur ở độ phân giải thấp rồi phóng lên) KHÔNG đạt ngưỡng sai số của
+# benchmarks/bench_mask.py (tối đa 36-77 / 255 ở biên mắt, mống mắt) -> chỉ để đo, không dùng khi chạy thật.
+# "none": không blur, chỉ dùng khi benchmark tách riêng thời gian vẽ polygon và thời gian blur
+MASK_RENDER_SCALE = float(os.getenv("MASK_RENDER_SCALE", "1.0"))
+MASK_BLUR_MODE = os.getenv("MASK_BLUR_MODE", "gaussian")
+
+BLUR_KSIZE = 45
+# Sigma OpenCV tự tính cho kernel 45 khi truyền sigma=0
+BLUR_SIGMA = 0.3 * ((BLUR_KSIZE - 1) * 0.5 - 1) + 0.8
+
+# --- FACEMESH WORKER POOL ---
+# Mỗi worker sở hữu riêng 1 instance FaceMesh (không dùng chung giữa các worker),
+# được tạo 1 lần và giữ "nóng" để không phải load lại model ở mỗi request.
+_worker_state = threading.local()
+
+def _get_face_mesh():
+    face_mesh = getattr(_worker_state, "face_mesh", None)
+    if face_mesh is None:
+        face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
+        _worker_state.face_mesh = face_mesh
+    return face_mesh
+
+def init_face_mesh_worker():
+    """Initializer cho mỗi worker: load sẵn model FaceMesh"""
+    _get_face_mesh()
+
 # INDEXES 
 LIP_INDICES = [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 409, 270, 269, 267, 0, 37, 39, 40, 185]
 LEFT_EYE = [33, 246, 161, 160, 159, 158, 157, 173, 133, 155, 154, 153, 145, 144, 163, 7, 33]
@@ -15,81 +49,145 @@ RIGHT_CHEEK = [345, 346, 347, 329, 355, 429, 420, 280, 352, 366, 323, 454, 356,
 NOSE_BRIDGE = [168, 6, 197, 195, 5, 4, 1, 19, 94]
 JAWLINE = [172, 136, 150, 149, 176, 148, 152, 377, 400, 378, 379, 365, 397]
 
-def create_makeup_mask(
-    image_path: str,
-    settings: dict
-) -> bytes:
-    
-    image = cv2.imread(image_path)
-    if image is None: raise ValueError("Lỗi ảnh")
-    mask = np.zeros(image.shape[:2], dtype=np.uint8)
-
-    use_lens = settings.get("use_lens", False)
-    contour_nose = settings.get("contour_nose", False)
-    contour_jaw = settings.get("contour_jaw", False)
-    intensity = settings.get("makeup_intensity", "medium")
-    
+# Index dạng mảng NumPy (tính sẵn 1 lần) để lấy polygon bằng fancy indexing
+_LIP_IDX = np.array(LIP_INDICES, dtype=np.intp)
+_LEFT_EYE_IDX = np.array(LEFT_EYE, dtype=np.intp)
+_RIGHT_EYE_IDX = np.array(RIGHT_EYE, dtype=np.intp)
+_LEFT_CHEEK_IDX = np.array(LEFT_CHEEK, dtype=np.intp)
+_RIGHT_CHEEK_IDX = np.array(RIGHT_CHEEK, dtype=np.intp)
+_NOSE_BRIDGE_IDX = np.array(NOSE_BRIDGE, dtype=np.intp)
+_JAWLINE_IDX = np.array(JAWLINE, dtype=np.intp)
+# (tâm, điểm biên) của mỗi mống mắt
+_IRIS_IDX = np.array([LEFT_IRIS[:2], RIGHT_IRIS[:2]], dtype=np.intp)
+
+# --- BƯỚC 1: LANDMARK (FaceMesh - tốn kém, nên cache lại) ---
+def detect_landmarks(image: np.ndarray) -> np.ndarray:
+    """Chạy FaceMesh, trả về mảng float32 (478, 3) toạ độ chuẩn hoá (x, y, z)"""
+    if image is None or image.size == 0: raise ValueError("Lỗi ảnh")
+
+    face_mesh = _get_face_mesh()
+    results = face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if not results.multi_face_landmarks: raise ValueError("No face")
+    fl = results.multi_face_landmarks[0]
+    return np.array([(lm.x, lm.y, lm.z) for lm in fl.landmark], dtype=np.float32)
+
+# --- BƯỚC 2: VẼ MASK (chỉ phụ thuộc landmark + settings) ---
+def _intensity_values(intensity: str):
     # --- CẤU HÌNH ĐỘ ĐẬM ---
     # Tăng giá trị mask lên gần 255 (trắng) để AI biết đây là vùng BẮT BUỘC sửa.
     # Mask quá nhạt (xám) khiến AI giữ lại ảnh gốc quá nhiều.
     if intensity == "high" or intensity == "heavy":
-        lip_val = 255    # Tối đa
-        blush_val = 200  # Rất đậm
-        eye_val = 255
+        return 255, 200, 255    # lip (tối đa), blush (rất đậm), eye
     elif intensity == "low" or intensity == "light":
-        lip_val = 180     
-        blush_val = 140   
-        eye_val = 180
+        return 180, 140, 180
     else: # Medium
-        lip_val = 230    
-        blush_val = 170
-        eye_val = 230
-
-    with mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True) as face_mesh:
-        results = face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        if not results.multi_face_landmarks: raise ValueError("No face")
-        fl = results.multi_face_landmarks[0]
-
-        def draw(indices, val):
-            pts = []
-            for i in indices:
-                lm = fl.landmark[i]
-                pts.append([int(lm.x*image.shape[1]), int(lm.y*image.shape[0])])
-            if pts: cv2.fillPoly(mask, np.array([pts], dtype=np.int32), (val))
-
-        # 1. Môi
-        draw(LIP_INDICES, lip_val)
-
-        # 2. Má
-        if settings.get("heavy_blush", False):
-            draw(LEFT_CHEEK, 220) # Má đậm
-            draw(RIGHT_CHEEK, 220)
-        else:
-            draw(LEFT_CHEEK, blush_val)
-            draw(RIGHT_CHEEK, blush_val)
-
-        # 3. Mắt (Phấn mắt)
-        draw(LEFT_EYE, eye_val)
-        draw(RIGHT_EYE, eye_val)
-
-        # 4. Contour
-        if contour_nose: draw(NOSE_BRIDGE, 150) # Tăng lên để khối mũi rõ hơn
-        if contour_jaw: draw(JAWLINE, 140)
-
-        # 5. Lens
-        def handle_iris(iris_idx):
-            c = fl.landmark[iris_idx[0]]
-            e = fl.landmark[iris_idx[1]]
-            cx, cy = int(c.x*image.shape[1]), int(c.y*image.shape[0])
-            r = int(np.sqrt((cx-e.x*image.shape[1])**2 + (cy-e.y*image.shape[0])**2) * 1.15)
-            
-            color = 180 if use_lens else 0 # Tăng độ đậm mask lens
-            cv2.circle(mask, (cx, cy), r, (color), -1)
-
-        handle_iris(LEFT_IRIS)
-        handle_iris(RIGHT_IRIS)
-
-        # Blur mask: Vẫn cần blur để biên không bị sắc, nhưng giảm kernel size một chút
-        # để giữ độ đậm ở trung tâm vùng makeup.
-        blurred = cv2.GaussianBlur(mask, (45, 45), 0)
-        return cv2.imencode('.png', blurred)[1].tobytes()
\ No newline at end of file
+        return 230, 170, 230
+
+def _mask_layers(settings: dict) -> list:
+    """Danh sách (index vùng, giá trị mask) theo đúng thứ tự vẽ"""
+    lip_val, blush_val, eye_val = _intensity_values(settings.get("makeup_intensity", "medium"))
+    if settings.get("heavy_blush", False): blush_val = 220 # Má đậm
+
+    layers = [
+        (_LIP_IDX, lip_val),            # 1. Môi
+        (_LEFT_CHEEK_IDX, blush_val),   # 2. Má
+        (_RIGHT_CHEEK_IDX, blush_val),
+        (_LEFT_EYE_IDX, eye_val),       # 3. Mắt (Phấn mắt)
+        (_RIGHT_EYE_IDX, eye_val),
+    ]
+    # 4. Contour
+    if settings.get("contour_nose", False): layers.append((_NOSE_BRIDGE_IDX, 150)) # Tăng lên để khối mũi rõ hơn
+    if settings.get("contour_jaw", False): layers.append((_JAWLINE_IDX, 140))
+    return layers
+
+def _render_shape(image_shape: tuple, scale: float) -> tuple:
+    h, w = image_shape[:2]
+    if scale >= 1.0: return h, w
+    return max(1, round(h * scale)), max(1, round(w * scale))
+
+def landmarks_to_pixels(landmarks: np.ndarray, image_shape: tuple):
+    """Đổi landmark chuẩn hoá sang toạ độ pixel 1 lần: (N, 2) float64 và (N, 2) int32"""
+    h, w = image_shape[:2]
+    pts_f = landmarks[:, :2] * np.array([w, h], dtype=np.float64)
+    return pts_f, pts_f.astype(np.int32)
+
+def _feather(mask: np.ndarray, scale: float, blur_mode: str) -> np.ndarray:
+    """Làm mềm biên mask, kernel tỉ lệ theo độ phân giải đang vẽ ("none": không blur, dùng để đo)"""
+    if blur_mode == "none":
+        return mask
+    if blur_mode == "box":
+        # 3 lần box blur bề rộng k có phương sai 3*(k^2-1)/12 ~ sigma^2 của Gaussian
+        sigma = BLUR_SIGMA * min(scale, 1.0)
+        k = max(1, int(round(math.sqrt(4 * sigma * sigma + 1))) | 1)
+        for _ in range(3):
+            mask = cv2.blur(mask, (k, k))
+        return mask
+
+    if scale >= 1.0:
+        return cv2.GaussianBlur(mask, (BLUR_KSIZE, BLUR_KSIZE), 0)
+    sigma = BLUR_SIGMA * scale
+    k = 2 * math.ceil(3 * sigma) + 1
+    return cv2.GaussianBlur(mask, (k, k), sigma)
+
+def _draw_mask(pts_f: np.ndarray, pts: np.ndarray, image_shape: tuple, settings: dict,
+               scale: float = 1.0, blur_mode: str = "gaussian") -> np.ndarray:
+    mask = np.zeros(_render_shape(image_shape, scale), dtype=np.uint8)
+
+    # Gom các vùng liên tiếp cùng giá trị vào 1 lần fillPoly (các vùng trong 1 nhóm
+    # là cặp trái/phải, không chồng lên nhau nên kết quả giống vẽ từng vùng).
+    for val, group in itertools.groupby(_mask_layers(settings), key=lambda layer: layer[1]):
+        cv2.fillPoly(mask, [pts[idx] for idx, _ in group], (val))
+
+    # 5. Lens
+    color = 180 if settings.get("use_lens", False) else 0 # Tăng độ đậm mask lens
+    centers = pts[_IRIS_IDX[:, 0]]
+    radii = (np.hypot(*(centers - pts_f[_IRIS_IDX[:, 1]]).T) * 1.15).astype(np.int32)
+    for (cx, cy), r in zip(centers.tolist(), radii.tolist()):
+        cv2.circle(mask, (cx, cy), r, (color), -1)
+
+    # Blur mask: Vẫn cần blur để biên không bị sắc, nhưng giảm kernel size một chút
+    # để giữ độ đậm ở trung tâm vùng makeup.
+    blurred = _feather(mask, scale, blur_mode)
+
+    # Vẽ ở độ phân giải thấp -> phóng lại về kích thước ảnh gốc
+    h, w = image_shape[:2]
+    if blurred.shape[:2] != (h, w):
+        blurred = cv2.resize(blurred, (w, h), interpolation=cv2.INTER_LINEAR)
+    return blurred
+
+def rasterize_mask(
+    landmarks: np.ndarray,
+    image_shape: tuple,
+    settings: dict,
+    render_scale: float = None,
+    blur_mode: str = None
+) -> np.ndarray:
+    """Trả về mask uint8 (HxW) dạng mảng, chưa encode"""
+    scale = MASK_RENDER_SCALE if render_scale is None else render_scale
+    blur_mode = blur_mode or MASK_BLUR_MODE
+    pts_f, pts = landmarks_to_pixels(landmarks, _render_shape(image_shape, scale))
+    return _draw_mask(pts_f, pts, image_shape, settings, scale, blur_mode)
+
+def rasterize_masks(
+    landmarks: np.ndarray,
+    image_shape: tuple,
+    settings_list: list,
+    render_scale: float = None,
+    blur_mode: str = None
+) -> list:
+    """Vẽ nhiều mask (nhiều look) trên cùng 1 bộ landmark, chỉ đổi toạ độ 1 lần"""
+    scale = MASK_RENDER_SCALE if render_scale is None else render_scale
+    blur_mode = blur_mode or MASK_BLUR_MODE
+    pts_f, pts = landmarks_to_pixels(landmarks, _render_shape(image_shape, scale))
+    return [_draw_mask(pts_f, pts, image_shape, settings, scale, blur_mode) for settings in settings_list]
+
+def create_makeup_mask(
+    image: np.ndarray,
+    settings: dict
+) -> np.ndarray:
+    # Span ghi vào registry của process đang chạy hàm này (trong process pool thì
+    # không hiện ở /metrics; main.py đo landmarks / rasterize tại chỗ gọi)
+    with span("mask.facemesh"):
+        landmarks = detect_landmarks(image)
+    with span("mask.rasterize"):
+        return rasterize_mask(landmarks, image.shape, settings)
@@ -0,0 +1,20 @@
+import os
+import cv2
+import numpy as np
+
+# --- CẤU HÌNH ENCODE MASK ---
+# Mask chỉ được encode 1 lần, ngay tại chỗ cần bytes (gửi Vertex AI).
+# PNG level 0-1: gần như không nén, nhanh hơn nhiều so với mặc định (3) mà vẫn lossless.
+MASK_ENCODING = os.getenv("MASK_ENCODING", ".png")
+MASK_PNG_COMPRESSION = int(os.getenv("MASK_PNG_COMPRESSION", "1"))
+
+def encode_mask(mask: np.ndarray, ext: str = None, png_compression: int = None) -> bytes:
+    """Encode mask (uint8 HxW) sang bytes theo định dạng lossless đã cấu hình"""
+    ext = ext or MASK_ENCODING
+    params = []
+    if ext == ".png":
+        level = MASK_PNG_COMPRESSION if png_compression is None else png_compression
+        params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+    ok, encoded = cv2.imencode(ext, mask, params)
+    if not ok: raise ValueError("Lỗi encode mask")
+    return encoded.tobytes()
@@ -1,38 +1,288 @@
 import os
+import logging
+import time
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import vertexai
 from vertexai.preview.vision_models import Image, ImageGenerationModel
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+from google.api_core import exceptions as google_exceptions
 import base64
+from modules.image_codec import encode_mask
+from modules.prompt_store import prompt_store, prompt_fingerprint
+from modules.metrics import registry, span
+
+logger = logging.getLogger(__name__)
 
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT", "ai-makeup-479109")
 LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
 KEY_PATH = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "ai-makeup-479109-5ce495c923af.json")
+MODEL_NAME = "imagegeneration@006"
+
+# Lỗi tạm thời từ Vertex (quá tải / hết quota / quá hạn) -> job queue được phép chạy lại
+TRANSIENT_VERTEX_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+class VertexTransientError(ValueError):
+    """Vertex AI lỗi tạm thời (giữ nguyên lỗi gốc ở __cause__), gọi lại sau có thể thành công"""
+
+# --- CLIENT DÙNG CHUNG ---
+class VertexClient:
+    """
+    Giữ credentials + model handle dùng chung cho cả process.
+    Khởi tạo lười (lần gọi đầu tiên), chỉ refresh token khi đã hết hạn.
+    `model_factory` cho phép thay model thật bằng stub local (chạy offline).
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, model_factory=None):
+        self.model_name = model_name
+        self._model_factory = model_factory
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._model = None
+        self.init_count = 0
+        self.init_seconds = 0.0
+        self.call_count = 0
+        self.call_seconds = 0.0
+        self.last_call_seconds = 0.0
+
+    def _load_model(self):
+        if self._model_factory is not None:
+            return self._model_factory()
+
+        # Đọc lại env lúc init vì main.py có thể đã đổi sang đường dẫn tuyệt đối
+        key_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", KEY_PATH)
+        if not key_path or not os.path.exists(key_path): raise FileNotFoundError(f"Missing Key: {key_path}")
+
+        self._credentials = service_account.Credentials.from_service_account_file(
+            key_path, scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+        vertexai.init(project=PROJECT_ID, location=LOCATION, credentials=self._credentials)
+        return ImageGenerationModel.from_pretrained(self.model_name)
+
+    def get_model(self):
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                self._model = self._load_model()
+                self.init_seconds = time.perf_counter() - start
+                self.init_count += 1
+                registry.observe("vertex.init", self.init_seconds)
+                logger.info(f"[Vertex] Khởi tạo model {self.model_name}: {self.init_seconds * 1000:.0f} ms")
+            elif self._credentials is not None and self._credentials.expired:
+                self._credentials.refresh(Request())
+            return self._model
+
+    def edit_image(self, **kwargs):
+        model = self.get_model()
+        start = time.perf_counter()
+        try:
+            return model.edit_image(**kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.call_count += 1
+                self.call_seconds += elapsed
+                self.last_call_seconds = elapsed
+            registry.observe("vertex.edit_image", elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "init_count": self.init_count,
+            "init_seconds": self.init_seconds,
+            "call_count": self.call_count,
+            "call_seconds_total": self.call_seconds,
+            "last_call_seconds": self.last_call_seconds,
+        }
+
+vertex_client = VertexClient()
+
+# Từ nhạy cảm (kèm dạng số nhiều) -> thay bằng "woman" trong 1 lần quét regex, chỉ khớp nguyên từ
+FORBIDDEN_WORDS = ["young", "student", "child", "children", "girl", "teen", "teenager", "underage",
+                   "school", "schoolgirl", "pores", "chest", "body", "bodies"]
+_FORBIDDEN_RE = re.compile(
+    r"\b(?:" + "|".join(sorted(map(re.escape, FORBIDDEN_WORDS), key=len, reverse=True)) + r")s?\b"
+)
 
 def clean_prompt_aggressively(text: str) -> str:
     """Loại bỏ các từ khóa nhạy cảm"""
-    forbidden_words = ["young", "student", "child", "girl", "teen", "underage", "school", "pores", "chest", "body"]
-    cleaned = text.lower()
-    for word in forbidden_words:
-        cleaned = cleaned.replace(word, "woman")
-    return cleaned
+    return _FORBIDDEN_RE.sub("woman", text.lower())
+
+# --- HEDGED REQUEST (Attempt 1 + Fallback) ---
+# HEDGE_MODE:
+#   "sequential": chỉ chạy attempt thứ 2 khi attempt đầu bị chặn / lỗi (như cũ)
+#   "hedged":     thêm vào đó, nếu attempt đầu chưa trả lời sau HEDGE_DELAY_SECONDS thì chạy song song attempt 2
+#   "parallel":   chạy cả 2 ngay từ đầu
+# Prompt mà Attempt 1 đã biết là bị chặn (theo prompt_store) sẽ chạy Fallback trước.
+HEDGE_MODE = os.getenv("HEDGE_MODE", "hedged")
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "15"))
+# Mỗi request trong IO pool (IO_WORKERS thread, xem execution.py) chạy tối đa 2 attempt cùng lúc
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "0")) or 2 * int(os.getenv("IO_WORKERS", "32"))
+
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="vertex-hedge")
+_hedge_lock = threading.Lock()
+# Attempt đã submit chưa xong (kể cả attempt thua vẫn đang chạy, không huỷ được) / đang chạy thật
+_hedge_inflight = 0
+_hedge_running = 0
+hedge_counters = {
+    "primary_wins": 0,
+    "fallback_wins": 0,
+    "fallback_first_known_blocked": 0,
+    "second_started_on_failure": 0,
+    "second_started_on_deadline": 0,
+    "second_started_immediately": 0,
+    "all_failed": 0,
+    "hedge_skipped_saturated": 0,
+}
+
+def _count(name: str):
+    with _hedge_lock: hedge_counters[name] += 1
+
+def hedge_stats() -> dict:
+    with _hedge_lock:
+        return {
+            **hedge_counters,
+            "known_prompts": len(prompt_store),
+            "pool_size": HEDGE_POOL_SIZE,
+            "inflight": _hedge_inflight,
+            "running": _hedge_running,
+            "queue_depth": _hedge_inflight - _hedge_running,
+        }
+
+def _hedge_saturated() -> bool:
+    """Pool đã kín -> attempt phụ (hedge) sẽ phải xếp hàng, chặn cả attempt chính của request sau"""
+    with _hedge_lock: return _hedge_inflight >= HEDGE_POOL_SIZE
+
+def _tracked_attempt(*args):
+    global _hedge_running
+    with _hedge_lock: _hedge_running += 1
+    try:
+        return _attempt(*args)
+    finally:
+        with _hedge_lock: _hedge_running -= 1
+
+def _attempt_done(_future):
+    global _hedge_inflight
+    with _hedge_lock: _hedge_inflight -= 1
+
+def _submit_attempt(*args):
+    global _hedge_inflight
+    with _hedge_lock: _hedge_inflight += 1
+    future = _hedge_pool.submit(_tracked_attempt, *args)
+    future.add_done_callback(_attempt_done)  # Gọi cả khi bị cancel
+    return future
+
+def _attempt(client, base_img, mask_img, label: str, prompt: str, guidance: float):
+    """1 lần gọi edit_image. Trả về ảnh hợp lệ hoặc None nếu bị chặn (lỗi thì raise)"""
+    logger.info(f"{label}: {prompt}")
+    response = client.edit_image(
+        base_image=base_img,
+        mask=mask_img,
+        prompt=prompt,
+        guidance_scale=guidance,
+        number_of_images=1
+    )
+    generated_images = getattr(response, 'images', response)
+    if generated_images and len(generated_images) > 0 and generated_images[0]._image_bytes:
+        logger.info(f"{label} Success!")
+        return generated_images[0]
+    logger.warning(f"{label} blocked.")
+    return None
+
+def _run_hedged(client, base_img, mask_img, attempts: dict, fingerprint: str):
+    """
+    attempts: {"primary": (label, prompt, guidance), "fallback": (...)}.
+    Chạy attempt ưu tiên và (khi cần) attempt còn lại, ảnh hợp lệ đầu tiên thắng.
+    """
+    order = ["primary", "fallback"]
+    if prompt_store.primary_known_blocked(fingerprint):
+        order.reverse()
+        _count("fallback_first_known_blocked")
+    first_name, second_name = order
+
+    def start(name):
+        return _submit_attempt(client, base_img, mask_img, *attempts[name])
+
+    futures = {start(first_name): first_name}
+    # Pool đang kín thì không hedge (chỉ chạy attempt 2 khi attempt đầu bị chặn / lỗi, như "sequential")
+    hedging = HEDGE_MODE in ("hedged", "parallel")
+    if hedging and _hedge_saturated():
+        hedging = False
+        _count("hedge_skipped_saturated")
+    if hedging and HEDGE_MODE == "parallel":
+        futures[start(second_name)] = second_name
+        _count("second_started_immediately")
+
+    pending = set(futures)
+    primary_blocked = False
+    last_error = None
+    while pending:
+        timeout = HEDGE_DELAY_SECONDS if (len(futures) == 1 and hedging) else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            hedging = False
+            if _hedge_saturated():
+                _count("hedge_skipped_saturated")
+                continue
+            # Attempt đầu quá hạn -> chạy thêm attempt còn lại song song
+            logger.warning(f"{attempts[first_name][0]} chưa trả lời sau {HEDGE_DELAY_SECONDS}s -> chạy song song")
+            second = start(second_name)
+            futures[second] = second_name
+            pending.add(second)
+            _count("second_started_on_deadline")
+            continue
+
+        for future in done:
+            name = futures[future]
+            try:
+                image_obj = future.result()
+                if image_obj is None and name == "primary": primary_blocked = True
+            except Exception as e:
+                logger.warning(f"{attempts[name][0]} Failed: {e}")
+                image_obj, last_error = None, e
+
+            if image_obj is not None:
+                # Bỏ call còn lại (chưa chạy thì huỷ, đang chạy thì bỏ qua kết quả)
+                for other in pending: other.cancel()
+                _count(f"{name}_wins")
+                prompt_store.record(fingerprint, primary_blocked, winner=name)
+                return image_obj
+
+            if len(futures) == 1:
+                second = start(second_name)
+                futures[second] = second_name
+                pending.add(second)
+                _count("second_started_on_failure")
+
+    _count("all_failed")
+    prompt_store.record(fingerprint, primary_blocked)
+    if last_error is not None: raise last_error
+    return None
 
 def generate_inpainted_image(
-    user_image_path: str,
-    mask_bytes: bytes,
+    user_image_bytes: bytes,
+    mask,
     prompt: str,
-    settings: dict = None
+    settings: dict = None,
+    client: VertexClient = None
 ) -> str:
-    print(f"Backend Module 3: Calling Vertex AI (High Pigment Mode)...")
+    logger.info(f"Backend Module 3: Calling Vertex AI (High Pigment Mode)...")
 
     if settings is None: settings = {}
-    if not KEY_PATH or not os.path.exists(KEY_PATH): raise FileNotFoundError(f"Missing Key: {KEY_PATH}")
+    if client is None: client = vertex_client
 
     try:
-        my_credentials = service_account.Credentials.from_service_account_file(KEY_PATH)
-        vertexai.init(project=PROJECT_ID, location=LOCATION, credentials=my_credentials)
-        model = ImageGenerationModel.from_pretrained("imagegeneration@006")
-
-        with open(user_image_path, "rb") as f: base_img = Image(image_bytes=f.read())
+        base_img = Image(image_bytes=user_image_bytes)
+        # Mask dạng mảng NumPy -> encode 1 lần tại đây (chỗ duy nhất cần bytes)
+        with span("vertex.mask_encode"):
+            mask_bytes = mask if isinstance(mask, (bytes, bytearray)) else encode_mask(mask)
         mask_img = Image(image_bytes=mask_bytes)
 
         # --- 1. XỬ LÝ TEXTURE ---
@@ -72,48 +322,26 @@ def generate_inpainted_image(
             f"{structure_rule}"
         )
 
-        print(f"Attempt 1 (Pigment Boost): {complex_prompt}")
-
-        try:
-            # Thay đổi: Tăng guidance_scale từ 5.0 -> 9.0
-            # Scale cao giúp AI bám sát prompt (tô màu) hơn là bám sát ảnh gốc.
-            strictness = 9.0 
-            response = model.edit_image(
-                base_image=base_img,
-                mask=mask_img,
-                prompt=complex_prompt,
-                guidance_scale=strictness,
-                number_of_images=1
-            )
-            generated_images = getattr(response, 'images', response)
-            if generated_images and len(generated_images) > 0 and generated_images[0]._image_bytes:
-                print("Attempt 1 Success!")
-                return _process_response(generated_images[0])
-            else:
-                print("Attempt 1 blocked. Retrying...")
-        except Exception as e:
-            print(f"Attempt 1 Failed: {e}")
-
-        # --- FALLBACK ---
         fallback_prompt = f"Heavy makeup application: {safe_user_prompt}. Vivid colors. {structure_rule}"
-        print(f"Attempt 2 (Fallback): {fallback_prompt}")
-
-        response_retry = model.edit_image(
-            base_image=base_img,
-            mask=mask_img,
-            prompt=fallback_prompt,
-            guidance_scale=7.0, # Vẫn giữ scale khá cao
-            number_of_images=1
-        )
-        generated_images_retry = getattr(response_retry, 'images', response_retry)
-        if generated_images_retry and len(generated_images_retry) > 0:
-             print("Attempt 2 Success!")
-             return _process_response(generated_images_retry[0])
+
+        # Thay đổi: Tăng guidance_scale từ 5.0 -> 9.0
+        # Scale cao giúp AI bám sát prompt (tô màu) hơn là bám sát ảnh gốc.
+        attempts = {
+            "primary": ("Attempt 1 (Pigment Boost)", complex_prompt, 9.0),
+            "fallback": ("Attempt 2 (Fallback)", fallback_prompt, 7.0), # Vẫn giữ scale khá cao
+        }
+        image_obj = _run_hedged(client, base_img, mask_img, attempts, prompt_fingerprint(complex_prompt))
+        if image_obj is not None:
+            return _process_response(image_obj)
         
         raise ValueError("Vertex AI từ chối tạo ảnh.")
 
+    except TRANSIENT_VERTEX_ERRORS as e:
+        logger.warning(f"Vertex AI Transient Error: {e}")
+        raise VertexTransientError(f"AI Error: {str(e)}") from e
+
     except Exception as e:
-        print(f"Vertex AI Critical Error: {e}")
+        logger.error(f"Vertex AI Critical Error: {e}")
         raise ValueError(f"AI Error: {str(e)}")
 
 def _process_response(image_obj):
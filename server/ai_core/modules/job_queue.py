@@ -0,0 +1,253 @@
+import os
+import logging
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --- CẤU HÌNH ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(BASE_DIR, "outputs", "jobs"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(JOB_DIR, "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Job "running" quá thời gian này (worker chết giữa chừng) sẽ được đưa lại vào hàng đợi
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+# Giữ kết quả bao lâu trước khi xoá (giây)
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+# Lỗi tạm thời (pool quá tải, timeout...) -> đưa job lại hàng đợi, chờ lùi dần 2^n lần, tối đa JOB_MAX_ATTEMPTS lần chạy
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "60"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    Hàng đợi job generate ảnh lưu trong SQLite (không cần broker ngoài).
+    Nhiều process (API hoặc worker riêng) có thể dùng chung 1 file DB.
+    Kết quả mỗi job được ghi ra outputs/jobs/<job_id>.json.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH, result_dir: str = JOB_DIR):
+        self.db_path = db_path
+        self.result_dir = result_dir
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._workers = []
+        os.makedirs(result_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT,
+                image BLOB,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL
+            )
+        """)
+        # DB tạo trước khi có retry -> thêm cột còn thiếu
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if "available_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    # --- GHI / ĐỌC (blocking, gọi qua thread) ---
+    def submit(self, image_bytes: bytes, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, payload, image, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload, ensure_ascii=False), image_bytes, time.time())
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Lấy job cũ nhất đang chờ và đã tới lượt (atomic giữa các process).
+        Trả về (id, image, payload, số lần đã chạy trước đó) hoặc None
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Job bị treo quá lease -> tính là 1 lần chạy: hết lượt thì failed, còn lượt thì trả lại hàng đợi
+                expired = now - JOB_LEASE_SECONDS
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, image = NULL, attempts = attempts + 1 "
+                    "WHERE status = ? AND started_at < ? AND attempts + 1 >= ?",
+                    (FAILED, "Job quá thời gian lease", now, RUNNING, expired, JOB_MAX_ATTEMPTS)
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, attempts = attempts + 1 "
+                    "WHERE status = ? AND started_at < ?",
+                    (QUEUED, RUNNING, expired)
+                )
+                row = self._conn.execute(
+                    "SELECT id, image, payload, attempts FROM jobs "
+                    "WHERE status = ? AND (available_at IS NULL OR available_at <= ?) ORDER BY created_at LIMIT 1",
+                    (QUEUED, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None: return None
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def complete(self, job_id: str, result: dict):
+        path = self._result_path(job_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._finish(job_id, DONE, None)
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, FAILED, error)
+
+    def retry(self, job_id: str, error: str, delay: float):
+        """Trả job về hàng đợi (giữ ảnh input), chỉ được claim lại sau `delay` giây"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, started_at = NULL, attempts = attempts + 1, "
+                "available_at = ? WHERE id = ?",
+                (QUEUED, error, time.time() + delay, job_id)
+            )
+
+    def _finish(self, job_id: str, status: str, error):
+        with self._lock:
+            # Xoá ảnh input ngay khi xong để DB không phình
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, image = NULL WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, error, created_at, started_at, finished_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None: return None
+
+        status, error, created_at, started_at, finished_at = row
+        job = {"job_id": job_id, "status": status, "created_at": created_at,
+               "started_at": started_at, "finished_at": finished_at}
+        if status == FAILED: job["error"] = error
+        if status == DONE:
+            try:
+                with open(self._result_path(job_id), "r", encoding="utf-8") as f: job["result"] = json.load(f)
+            except OSError:
+                job["status"], job["error"] = FAILED, "Kết quả đã bị xoá"
+        return job
+
+    def purge_expired(self):
+        cutoff = time.time() - JOB_RESULT_TTL_SECONDS
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, cutoff)
+            )]
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+        for job_id in ids:
+            try: os.remove(self._result_path(job_id))
+            except OSError: pass
+
+    def stats(self, window_seconds: float = 300) -> dict:
+        since = time.time() - window_seconds
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            retrying = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND attempts > 0", (QUEUED,)
+            ).fetchone()[0]
+            avg_wait, max_wait = self._conn.execute(
+                "SELECT AVG(started_at - created_at), MAX(started_at - created_at) FROM jobs "
+                "WHERE started_at IS NOT NULL AND started_at >= ?", (since,)
+            ).fetchone()
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+        return {
+            "queue_depth": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "retrying": retrying,
+            "wait_seconds_avg": avg_wait or 0.0,
+            "wait_seconds_max": max_wait or 0.0,
+            "oldest_queued_seconds": (time.time() - oldest) if oldest else 0.0,
+            "workers": len(self._workers),
+        }
+
+    def _result_path(self, job_id: str) -> str:
+        return os.path.join(self.result_dir, f"{job_id}.json")
+
+    # --- WORKER (asyncio) ---
+    def notify(self):
+        if self._wakeup is not None: self._wakeup.set()
+
+    def start_workers(self, handler, count: int = JOB_WORKERS, retry_on: tuple = ()):
+        """
+        handler: coroutine (image_bytes, payload) -> dict kết quả
+        retry_on: các exception tạm thời -> chạy lại job sau (backoff) thay vì đánh dấu failed ngay
+        """
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._worker_loop(handler, retry_on)) for _ in range(count)]
+        if count: logger.info(f"[Jobs] Đã khởi động {count} worker")
+
+    async def stop_workers(self):
+        for task in self._workers: task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker_loop(self, handler, retry_on: tuple):
+        last_purge = 0.0
+        while True:
+            job = await asyncio.to_thread(self.claim)
+            if job is None:
+                if time.monotonic() - last_purge > 60:
+                    await asyncio.to_thread(self.purge_expired)
+                    last_purge = time.monotonic()
+                # Chờ job mới (notify) hoặc poll lại (job do process khác submit)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError: pass
+                continue
+
+            job_id, image_bytes, payload, attempts = job
+            try:
+                result = await handler(image_bytes, payload)
+                await asyncio.to_thread(self.complete, job_id, result)
+            except asyncio.CancelledError:
+                raise
+            except retry_on as e:
+                if attempts + 1 >= JOB_MAX_ATTEMPTS:
+                    logger.error(f"[Jobs] Job {job_id} lỗi sau {attempts + 1} lần chạy: {e}")
+                    await asyncio.to_thread(self.fail, job_id, str(e))
+                    continue
+                delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** attempts)
+                logger.warning(f"[Jobs] Job {job_id} lỗi tạm thời ({e}), chạy lại sau {delay:.1f}s")
+                await asyncio.to_thread(self.retry, job_id, str(e), delay)
+            except Exception as e:
+                logger.error(f"[Jobs] Job {job_id} lỗi: {e}")
+                await asyncio.to_thread(self.fail, job_id, str(e))
+
+
+job_queue = JobQueue()
@@ -0,0 +1,31 @@
+import sys
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+# Handler ghi log chạy ở thread riêng: code xử lý request chỉ đẩy record vào queue,
+# không bị chặn bởi việc ghi stdout.
+_listener = None
+
+
+def setup_logging(level: int = logging.INFO):
+    global _listener
+    if _listener is not None: return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [QueueHandler(log_queue)]
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,99 @@
+import re
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# --- HISTOGRAM THỜI GIAN TỪNG STAGE ---
+# Bucket (giây): từ vài ms (vẽ mask, tra cache) tới hàng chục giây (Vertex AI)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+STAGE_METRIC = "vto_stage_duration_seconds"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts): self.counts[index] += 1
+            self.count += 1
+            self.total += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total
+
+
+class MetricsRegistry:
+    """Histogram theo (tên metric, stage). Mỗi process có 1 registry riêng."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, stage: str) -> Histogram:
+        key = (name, stage)
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        return hist
+
+    def observe(self, stage: str, seconds: float, name: str = STAGE_METRIC):
+        self.histogram(name, stage).observe(seconds)
+
+    def render(self) -> str:
+        """Xuất theo định dạng text của Prometheus"""
+        lines = []
+        by_name = {}
+        with self._lock:
+            items = sorted(self._histograms.items())
+        for (name, stage), hist in items:
+            by_name.setdefault(name, []).append((stage, hist))
+
+        for name, stages in by_name.items():
+            lines.append(f"# TYPE {name} histogram")
+            for stage, hist in stages:
+                counts, count, total = hist.snapshot()
+                cumulative = 0
+                for bound, c in zip(hist.buckets, counts):
+                    cumulative += c
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(stage: str):
+    """Đo thời gian 1 đoạn code (dùng được cả quanh `await`) và ghi vào histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, time.perf_counter() - start)
+
+
+def render_gauges(stats: dict, prefix: str = "vto") -> str:
+    """Đổi dict thống kê lồng nhau (như /vto/stats) sang gauge Prometheus"""
+    lines = []
+
+    def walk(path, value):
+        if isinstance(value, dict):
+            for key, child in value.items(): walk(path + [str(key)], child)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metric = re.sub(r"[^a-zA-Z0-9_]", "_", "_".join([prefix] + path))
+            lines.append(f"{metric} {value}")
+
+    walk([], stats)
+    return "\n".join(lines) + "\n"
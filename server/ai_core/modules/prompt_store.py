@@ -0,0 +1,117 @@
+import os
+import logging
+import json
+import time
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# --- CẤU HÌNH ---
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT_STORE_PATH = os.getenv("PROMPT_STORE_PATH", os.path.join(BASE_DIR, "outputs", "prompt_outcomes.json"))
+# Gom nhiều lần ghi nhận vào 1 lần ghi file (giây)
+PROMPT_STORE_FLUSH_SECONDS = float(os.getenv("PROMPT_STORE_FLUSH_SECONDS", "5"))
+PROMPT_STORE_MAX_ENTRIES = int(os.getenv("PROMPT_STORE_MAX_ENTRIES", "50000"))
+# Kết luận "Attempt 1 bị chặn" chỉ giữ trong khoảng này kể từ lần bị chặn gần nhất (prompt / model có thể đã đổi)
+PROMPT_BLOCKED_TTL_SECONDS = float(os.getenv("PROMPT_BLOCKED_TTL_SECONDS", str(24 * 3600)))
+# Trong thời gian đó, cứ mỗi N lần đi thẳng vào Fallback thì thử lại Attempt 1 trước 1 lần
+PROMPT_REPROBE_EVERY = int(os.getenv("PROMPT_REPROBE_EVERY", "20"))
+
+
+def prompt_fingerprint(text: str) -> str:
+    """Fingerprint prompt (đã làm sạch), bỏ qua khác biệt khoảng trắng"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class PromptOutcomeStore:
+    """
+    Lưu (ra file JSON) kết quả Vertex AI theo fingerprint prompt:
+    số lần Attempt 1 bị chặn và attempt nào đã thành công.
+    Dùng để prompt đã biết bị chặn đi thẳng vào Fallback, không tốn call Attempt 1.
+    Entry sắp theo thứ tự dùng gần nhất (OrderedDict) -> bỏ entry cũ nhất không cần sort.
+    Ghi file do 1 thread nền đảm nhận (mỗi PROMPT_STORE_FLUSH_SECONDS), request không chờ disk.
+    """
+
+    def __init__(self, path: str = PROMPT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._flusher = None
+        self._data = OrderedDict()
+        try:
+            with open(path, "r", encoding="utf-8") as f: loaded = json.load(f)
+            self._data.update(sorted(loaded.items(), key=lambda item: item[1].get("updated_at", 0)))
+        except (OSError, ValueError, AttributeError): pass
+
+    def primary_known_blocked(self, fingerprint: str) -> bool:
+        """
+        Attempt 1 bị chặn nhiều hơn số lần thành công (và lần chặn gần nhất chưa quá TTL)
+        -> nên bắt đầu bằng Fallback. Mỗi PROMPT_REPROBE_EVERY lần trả True thì trả False 1 lần để thử lại.
+        """
+        with self._lock:
+            entry = self._data.get(fingerprint)
+            if not entry or entry.get("primary_blocked", 0) <= entry.get("primary_ok", 0): return False
+            if time.time() - entry.get("blocked_at", entry.get("updated_at", 0)) > PROMPT_BLOCKED_TTL_SECONDS:
+                return False
+            entry["fallback_first"] = entry.get("fallback_first", 0) + 1
+            return entry["fallback_first"] % PROMPT_REPROBE_EVERY != 0
+
+    def record(self, fingerprint: str, primary_blocked: bool, winner: str = None):
+        with self._lock:
+            entry = self._data.setdefault(fingerprint, {})
+            self._data.move_to_end(fingerprint)
+            now = time.time()
+            if primary_blocked:
+                entry["primary_blocked"] = entry.get("primary_blocked", 0) + 1
+                entry["blocked_at"] = now
+            if winner == "primary":
+                # Attempt 1 chạy được lại -> bỏ các lần bị chặn cũ
+                entry["primary_blocked"] = 0
+            if winner: entry[f"{winner}_ok"] = entry.get(f"{winner}_ok", 0) + 1
+            entry["updated_at"] = now
+            self._dirty = True
+
+            # Bỏ các entry cũ nhất
+            while len(self._data) > PROMPT_STORE_MAX_ENTRIES:
+                self._data.popitem(last=False)
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="prompt-store-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(PROMPT_STORE_FLUSH_SECONDS):
+            self.flush()
+
+    def close(self):
+        """Dừng thread ghi nền và ghi nốt thay đổi còn lại"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty: return
+            snapshot = json.dumps(self._data)
+            self._dirty = False
+        try:
+            with self._file_lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f: f.write(snapshot)
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"[PromptStore] Lỗi ghi file: {e}")
+
+    def __len__(self):
+        return len(self._data)
+
+
+prompt_store = PromptOutcomeStore()
+atexit.register(prompt_store.close)
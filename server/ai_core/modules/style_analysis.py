@@ -1,25 +1,73 @@
 import google.generativeai as genai
+import logging
 import os
+import re
 import json
+import asyncio
+import unicodedata
+from modules.cache import TTLCache
+from modules.metrics import span
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "gemini-2.5-flash"
+STYLE_CACHE_TTL_SECONDS = float(os.getenv("STYLE_CACHE_TTL_SECONDS", "600"))
+STYLE_CACHE_MAX_ENTRIES = int(os.getenv("STYLE_CACHE_MAX_ENTRIES", "1024"))
 
 # --- CẤU HÌNH API ---
-def _configure_gemini():
-    try:
-        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-        return True
-    except KeyError:
-        print("Error: GEMINI_API_KEY not found.")
-        return False
+# Model handle dùng chung cho cả process (tái sử dụng kết nối), chỉ configure 1 lần
+_model = None
+
+def _get_model():
+    global _model
+    if _model is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            logger.error("Error: GEMINI_API_KEY not found.")
+            return None
+        genai.configure(api_key=api_key)
+        _model = genai.GenerativeModel(MODEL_NAME)
+    return _model
+
+# --- CACHE + GỘP REQUEST TRÙNG ---
+# Kết quả đã parse được cache theo nội dung request (đã chuẩn hoá);
+# các request giống hệt nhau đang chạy đồng thời chỉ gọi Gemini 1 lần.
+style_cache = TTLCache(STYLE_CACHE_MAX_ENTRIES, STYLE_CACHE_TTL_SECONDS)
+_inflight = {}
+coalesced_count = 0
+
+def _normalize_request(user_request: str) -> str:
+    text = unicodedata.normalize("NFC", user_request or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def style_stats() -> dict:
+    return {**style_cache.stats(), "coalesced": coalesced_count, "inflight": len(_inflight)}
 
 # --- HÀM TƯ VẤN  ---
 async def consult_styles_with_gemini(user_request: str) -> list:
-    if not _configure_gemini(): return [_get_fallback_data()]
+    global coalesced_count
+    key = _normalize_request(user_request)
+
+    cached = style_cache.get(key)
+    if cached is not None: return cached
 
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    task = _inflight.get(key)
+    if task is not None:
+        coalesced_count += 1
+    else:
+        task = asyncio.ensure_future(_consult_and_cache(key, user_request))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: 1 client huỷ request không làm huỷ call Gemini của các client khác
+    return await asyncio.shield(task)
 
-    print(f"Gemini Consulting: '{user_request}'...")
+async def _consult_and_cache(key: str, user_request: str) -> list:
+    styles, ok = await _consult(user_request)
+    if ok: style_cache.put(key, styles)
+    return styles
 
-    prompt = (
+def _build_prompt(user_request: str) -> str:
+    return (
         f"User context: '{user_request}'.\n"
         "As a Professional Makeup Artist, suggest 3 DISTINCT makeup looks.\n"
         "Return a raw JSON LIST (Array) of 3 objects.\n"
@@ -55,17 +103,106 @@ async def consult_styles_with_gemini(user_request: str) -> list:
         "}\n"
     )
 
+async def _consult(user_request: str):
+    """Gọi Gemini, trả về (danh sách style, ok). ok=False nghĩa là dữ liệu fallback (không cache)"""
+    model = _get_model()
+    if model is None: return [_get_fallback_data()], False
+
+    logger.info(f"Gemini Consulting: '{user_request}'...")
+
     try:
-        response = await model.generate_content_async(prompt)
+        with span("gemini.call"):
+            response = await model.generate_content_async(_build_prompt(user_request))
         result = _parse_json_response(response.text)
         
-        if isinstance(result, list): return result
-        if isinstance(result, dict) and "styles" in result: return result["styles"]
-        return [result] if isinstance(result, dict) else [_get_fallback_data()]
+        if isinstance(result, list): return result, True
+        if isinstance(result, dict) and "styles" in result: return result["styles"], True
+        if isinstance(result, dict):
+            # _parse_json_response trả dữ liệu fallback khi JSON lỗi -> không cache
+            return [result], result.get("id") != "fallback_1"
+        return [_get_fallback_data()], False
             
     except Exception as e:
-        print(f"Lỗi Gemini: {e}")
-        return [_get_fallback_data()]
+        logger.error(f"Lỗi Gemini: {e}")
+        return [_get_fallback_data()], False
+
+# --- HÀM TƯ VẤN (STREAMING) ---
+async def stream_styles_with_gemini(user_request: str):
+    """
+    Async generator: trả từng look ngay khi Gemini sinh xong object JSON của look đó.
+    Lỗi giữa chừng (hoặc không parse được look nào) -> trả thêm dữ liệu fallback.
+    """
+    key = _normalize_request(user_request)
+    cached = style_cache.get(key)
+    if cached is not None:
+        for look in cached: yield look
+        return
+
+    model = _get_model()
+    if model is None:
+        yield _get_fallback_data()
+        return
+
+    logger.info(f"Gemini Consulting (stream): '{user_request}'...")
+
+    parser = _LookStreamParser()
+    looks = []
+    try:
+        response = await model.generate_content_async(_build_prompt(user_request), stream=True)
+        async for chunk in response:
+            for look in parser.feed(chunk.text):
+                looks.append(look)
+                yield look
+    except Exception as e:
+        logger.error(f"Lỗi Gemini (stream): {e}")
+        yield _get_fallback_data()
+        return
+
+    if looks:
+        style_cache.put(key, looks)
+    else:
+        yield _get_fallback_data()
+
+class _LookStreamParser:
+    """Parse mảng JSON theo từng đoạn text: trả về mỗi object cấp 1 ngay khi đóng ngoặc"""
+
+    def __init__(self):
+        self._started = False  # Đã gặp '[' mở mảng chưa (bỏ qua ```json phía trước)
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+
+    def feed(self, text: str) -> list:
+        done = []
+        for ch in text:
+            if not self._started:
+                if ch == "[": self._started = True
+                continue
+            if self._depth == 0:
+                # Giữa các object: chỉ có dấu phẩy, khoảng trắng hoặc ']'
+                if ch == "{":
+                    self._depth = 1
+                    self._buf = [ch]
+                continue
+
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif ch == "\\": self._escape = True
+                elif ch == '"': self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        done.append(json.loads("".join(self._buf)))
+                    except ValueError: pass
+                    self._buf = []
+        return done
 
 # --- HELPER ---
 def _parse_json_response(text_response: str):
@@ -0,0 +1,55 @@
+import copy
+from benchmarks.stubs import make_courses
+from modules.course_catalog import CourseCatalog
+
+
+class FakeCourses:
+    """Collection tối giản: chỉ hỗ trợ 2 truy vấn CourseCatalog dùng, trả bản copy như MongoDB"""
+
+    def __init__(self, docs: list):
+        self.docs = [{**doc, "_id": i} for i, doc in enumerate(docs)]
+
+    def find(self, query: dict, projection: dict = None):
+        for doc in self.docs:
+            if "status" in query and doc.get("status") != query["status"]: continue
+            if "updatedAt" in query and doc["updatedAt"] < query["updatedAt"]["$gte"]: continue
+            yield copy.deepcopy(doc)
+
+
+def make_catalog(count: int = 50):
+    collection = FakeCourses(make_courses(count))
+    catalog = CourseCatalog()
+    catalog.load(collection)
+    return catalog, collection
+
+
+def test_poll_without_changes_keeps_ranker():
+    catalog, _ = make_catalog()
+    ranker, fallback = catalog._ranker, catalog._fallback
+
+    for _ in range(3): catalog.poll()
+
+    assert catalog._ranker is ranker
+    assert catalog._fallback is fallback
+    assert catalog.stats()["polls"] == 3
+    assert catalog.stats()["updated"] == 0
+
+
+def test_poll_applies_real_changes():
+    catalog, collection = make_catalog()
+    ranker = catalog._ranker
+    newest = max(doc["updatedAt"] for doc in collection.docs)
+
+    published = next(doc for doc in collection.docs if doc["status"] == "published")
+    published.update(name="Son Môi Đỏ Cam", status="draft", updatedAt=newest + 1)
+    catalog.poll()
+
+    assert catalog._ranker is not ranker
+    assert str(published["_id"]) not in catalog._docs
+    assert catalog.stats()["updated"] == 1
+
+    # Poll kế tiếp không có gì mới -> giữ nguyên ranker vừa dựng
+    ranker = catalog._ranker
+    catalog.poll()
+    assert catalog._ranker is ranker
+    assert catalog.stats()["updated"] == 1